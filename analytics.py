@@ -0,0 +1,280 @@
+import os
+import json
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import store
+import tenancy
+from fileutil import file_lock
+
+SPLITS_DIR = os.path.join(tenancy.DATA_DIR, "splits")  # legacy mode; athletes keep theirs in their partition
+
+# One flat binary file per column; row i of every file is the same split
+COLUMNS = {
+    "activity_id": np.int64,
+    "start_ts": np.int64,       # activity start (epoch seconds, 0 if unknown)
+    "sport": np.int8,
+    "split": np.int16,
+    "distance": np.float32,
+    "moving_time": np.float32,
+    "elevation_difference": np.float32,
+    "average_speed": np.float32,
+    "average_heartrate": np.float32,  # NaN when no HR
+    "pace_zone": np.int8,             # -1 when missing
+}
+SPORTS = {"Run": 1, "Ride": 2, "Swim": 3}
+
+# Defaults when the profile doesn't say otherwise
+REST_HR = 60
+MAX_HR = 190
+THRESHOLD_HR = 170
+HR_ZONE_EDGES = [0.85, 0.90, 0.95, 1.00]  # fractions of threshold HR (Friel-style Z1..Z5)
+ATL_DAYS = 7
+CTL_DAYS = 42
+
+CACHED_ATHLETES = 64
+
+_lock = threading.Lock()
+_cache = OrderedDict()  # splits dir -> (file signatures, columns)
+
+
+def _splits_dir():
+    return tenancy.path("splits", legacy=SPLITS_DIR)
+
+
+def _path(column):
+    return os.path.join(_splits_dir(), f"{column}.bin")
+
+
+def _signature(path):
+    # Appends change the size, rewrites (os.replace) the inode; mtime covers the rest
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def load_columns():
+    """All split columns as NumPy arrays, re-read only when the files changed."""
+    directory = _splits_dir()
+    signatures = tuple(_signature(_path(c)) for c in COLUMNS)
+    with _lock:
+        cached = _cache.get(directory)
+        if cached and cached[0] == signatures:
+            _cache.move_to_end(directory)
+            return cached[1]
+        columns = {}
+        for column, dtype in COLUMNS.items():
+            path = _path(column)
+            columns[column] = np.fromfile(path, dtype=dtype) if os.path.exists(path) else np.empty(0, dtype)
+        # An interrupted append can leave columns of unequal length; ignore the torn tail
+        rows = min(len(a) for a in columns.values())
+        columns = {c: a[:rows] for c, a in columns.items()}
+        _cache[directory] = (signatures, columns)
+        _cache.move_to_end(directory)
+        while len(_cache) > CACHED_ATHLETES:
+            _cache.popitem(last=False)
+        return columns
+
+
+def _split_rows(activity_id, start_ts, sport, splits):
+    n = len(splits)
+    rows = {
+        "activity_id": np.full(n, activity_id),
+        "start_ts": np.full(n, start_ts or 0),
+        "sport": np.full(n, SPORTS.get(sport, 0)),
+        "split": [s.get("split", i + 1) for i, s in enumerate(splits)],
+        "distance": [s.get("distance", 0) for s in splits],
+        "moving_time": [s.get("moving_time", 0) for s in splits],
+        "elevation_difference": [s.get("elevation_difference") or 0 for s in splits],
+        "average_speed": [s.get("average_speed", 0) for s in splits],
+        "average_heartrate": [s.get("average_heartrate", np.nan) for s in splits],
+        "pace_zone": [s.get("pace_zone", -1) for s in splits],
+    }
+    return {c: np.asarray(v, dtype=COLUMNS[c]) for c, v in rows.items()}
+
+
+def append_activities(activities):
+    """Append splits for activities not stored yet.
+
+    `activities` is an iterable of (activity_id, start_ts, sport, splits).
+    """
+    os.makedirs(_splits_dir(), exist_ok=True)
+    with file_lock(os.path.join(_splits_dir(), "columns")):
+        known = set(np.unique(load_columns()["activity_id"]).tolist())
+        batches = [
+            _split_rows(activity_id, start_ts, sport, splits)
+            for activity_id, start_ts, sport, splits in activities
+            if splits and activity_id not in known
+        ]
+        return _append_locked(batches)
+
+
+def _append_locked(batches):
+    if not batches:
+        return 0
+    for column in COLUMNS:
+        data = np.concatenate([b[column] for b in batches])
+        with open(_path(column), "ab") as f:
+            f.write(data.tobytes())
+    return sum(len(b["activity_id"]) for b in batches)
+
+
+def _rewrite_locked(columns):
+    for column, data in columns.items():
+        tmp_path = _path(column) + ".tmp"
+        data.tofile(tmp_path)
+        os.replace(tmp_path, _path(column))
+
+
+def remove_activity(activity_id):
+    """Rewrite the columns without one activity's splits (rare: deletions only)."""
+    os.makedirs(_splits_dir(), exist_ok=True)
+    with file_lock(os.path.join(_splits_dir(), "columns")):
+        columns = load_columns()
+        keep = columns["activity_id"] != activity_id
+        if keep.all():
+            return 0
+        _rewrite_locked({c: data[keep] for c, data in columns.items()})
+        return int((~keep).sum())
+
+
+def replace_detail(detail):
+    """Store an updated activity's splits; returns True if they changed.
+
+    Edits that leave the splits alone (title, description, gear...) don't
+    touch the files; new activities are appended, changed ones rewritten.
+    """
+    os.makedirs(_splits_dir(), exist_ok=True)
+    new = _split_rows(detail["id"], store.iso_to_ts(detail.get("start_date")), detail.get("type"),
+                      detail.get("splits_metric") or [])
+    with file_lock(os.path.join(_splits_dir(), "columns")):
+        columns = load_columns()
+        mine = columns["activity_id"] == detail["id"]
+        if all(np.array_equal(columns[c][mine], new[c], equal_nan=True) for c in COLUMNS):
+            return False
+        if not mine.any():
+            _append_locked([new])
+        else:
+            _rewrite_locked({c: np.concatenate([data[~mine], new[c]]) for c, data in columns.items()})
+        return True
+
+
+def append_detail(detail):
+    """Add one Strava activity detail's splits_metric."""
+    start_ts = store.iso_to_ts(detail.get("start_date"))
+    return append_activities([(detail["id"], start_ts, detail.get("type"), detail.get("splits_metric") or [])])
+
+
+def seed_from_file(path="activities.json"):
+    """Import the legacy activities.json (dates looked up in the store when known)."""
+    if not os.path.exists(path):
+        return 0
+    with open(path, "r") as f:
+        activities = json.load(f)
+    rows = []
+    for a in activities:
+        stored = store.get_activity(a["id"])
+        rows.append((a["id"], stored["start_ts"] if stored else 0, a.get("type"), a.get("splits") or []))
+    return append_activities(rows)
+
+
+def _thresholds(profile):
+    run = ((profile or {}).get("thresholds") or {}).get("run") or {}
+    try:
+        threshold_hr = float(run.get("threshold_hr") or THRESHOLD_HR)
+    except (TypeError, ValueError):
+        threshold_hr = THRESHOLD_HR
+    return threshold_hr
+
+
+def split_loads(cols, threshold_hr, rest_hr=REST_HR, max_hr=MAX_HR):
+    """Banister TRIMP and hrTSS for every split (0 where HR is missing)."""
+    minutes = cols["moving_time"].astype(np.float64) / 60
+    hr = cols["average_heartrate"].astype(np.float64)
+    has_hr = ~np.isnan(hr)
+    hrr = np.clip((np.where(has_hr, hr, rest_hr) - rest_hr) / (max_hr - rest_hr), 0, 1)
+    trimp = np.where(has_hr, minutes * hrr * 0.64 * np.exp(1.92 * hrr), 0.0)
+    tss = np.where(has_hr, (minutes / 60) * (np.where(has_hr, hr, 0) / threshold_hr) ** 2 * 100, 0.0)
+    return trimp, tss
+
+
+def zone_distributions(cols, threshold_hr):
+    """Share of moving time spent in each pace zone and HR zone."""
+    time = cols["moving_time"].astype(np.float64)
+
+    pace = cols["pace_zone"]
+    valid = pace >= 0
+    pace_time = np.bincount(pace[valid], weights=time[valid]) if valid.any() else np.zeros(0)
+
+    hr = cols["average_heartrate"]
+    has_hr = ~np.isnan(hr)
+    hr_zone = np.digitize(hr[has_hr] / threshold_hr, HR_ZONE_EDGES)
+    hr_time = np.bincount(hr_zone, weights=time[has_hr], minlength=len(HR_ZONE_EDGES) + 1)
+
+    def shares(t):
+        return (t / t.sum()).round(3).tolist() if t.sum() else []
+
+    return {"pace_zones": shares(pace_time), "hr_zones": shares(hr_time)}
+
+
+def _ewma_last(series, days):
+    """Final value of the EWMA y += (x - y) / days started at 0, in closed form:
+    y_n = a * sum_k (1 - a)**k * x_(n-k)."""
+    a = 1 / days
+    weights = (1 - a) ** np.arange(len(series) - 1, -1, -1)
+    return a * float(weights @ series)
+
+
+def training_load(cols, daily_load, today_ts=None):
+    """ATL/CTL/TSB from a daily load series (exponentially weighted averages)."""
+    dated = cols["start_ts"] > 0
+    if not dated.any():
+        return None
+    days = cols["start_ts"][dated] // 86400
+    first = days.min()
+    last = max(days.max(), (today_ts or 0) // 86400)
+    series = np.bincount(days - first, weights=daily_load[dated], minlength=last - first + 1)
+
+    atl, ctl = _ewma_last(series, ATL_DAYS), _ewma_last(series, CTL_DAYS)
+    return {"atl": round(atl, 1), "ctl": round(ctl, 1), "tsb": round(ctl - atl, 1),
+            "last_7d": round(float(series[-7:].sum()), 1)}
+
+
+def summary(profile=None, today_ts=None):
+    cols = load_columns()
+    if not len(cols["activity_id"]):
+        return None
+    threshold_hr = _thresholds(profile)
+    trimp, tss = split_loads(cols, threshold_hr)
+    result = {
+        "activities": int(len(np.unique(cols["activity_id"]))),
+        "splits": int(len(cols["activity_id"])),
+        "km": round(float(cols["distance"].sum()) / 1000, 1),
+        "hours": round(float(cols["moving_time"].sum()) / 3600, 1),
+        "trimp": round(float(trimp.sum()), 1),
+        "tss": round(float(tss.sum()), 1),
+        "load": training_load(cols, trimp, today_ts),
+    }
+    result.update(zone_distributions(cols, threshold_hr))
+    return result
+
+
+def summary_text(profile=None, today_ts=None):
+    """One compact line of numbers for LLM prompts."""
+    s = summary(profile, today_ts)
+    if not s:
+        return ""
+    text = (f"Training history: {s['activities']} activities, {s['km']} km, {s['hours']} h; "
+            f"TRIMP {s['trimp']}, hrTSS {s['tss']}")
+    if s["load"]:
+        load = s["load"]
+        text += f"; CTL {load['ctl']}, ATL {load['atl']}, TSB {load['tsb']}, 7-day TRIMP {load['last_7d']}"
+    if s["hr_zones"]:
+        text += "; HR zones Z1-Z5 " + "/".join(f"{z * 100:.0f}%" for z in s["hr_zones"])
+    if s["pace_zones"]:
+        text += "; pace zones " + "/".join(f"{z * 100:.0f}%" for z in s["pace_zones"])
+    return text
@@ -1,24 +1,58 @@
 
 import os
-import requests
+import copy
+import hmac
 import json
+import time
 import calendar
+import threading
 from flask import Flask, redirect, request
 from dotenv import load_dotenv
-from PIL import Image, ImageDraw, ImageFont
-import polyline
 
+import click
+
+import analytics
+import backfill
+import chat_journal
+import doccache
+import geometry
+import ics
+import llm_cache
+import metrics
+import pagecache
+import photos
+import plan_store
+import plan_worker
+import prompts
+import retrieval
+import stickers
+import store
+import streams
+import thumbnails
+import strava_client
+import sync
+import tenancy
+import webhooks
+from fileutil import persistent_secret
+from tokens import TokenManager
 from openai import OpenAI
-from datetime import datetime
+from datetime import datetime, timezone
 from flask import Flask, redirect, request, render_template
-from datetime import date
+from datetime import date, timedelta
 from flask import render_template_string, request
 
 from flask import Flask, render_template, request, redirect, url_for
+from flask import Response, stream_with_context, send_file, g, session
+from flask import before_render_template, template_rendered
 
 load_dotenv()
 
 app = Flask(__name__)
+# Sessions, calendar feed URLs and photo links are signed with SECRET_KEY; without
+# one a key is generated once under the data directory and shared by all workers
+SECRET_KEY = (os.getenv("SECRET_KEY", "").encode()
+              or persistent_secret(os.path.join(tenancy.DATA_DIR, "secret_key")))
+app.secret_key = SECRET_KEY
 
 CLIENT_ID = os.getenv("STRAVA_CLIENT_ID")
 CLIENT_SECRET = os.getenv("STRAVA_CLIENT_SECRET")
@@ -26,71 +60,190 @@ REDIRECT_URI = os.getenv("STRAVA_REDIRECT_URI")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")   # get from .env
 
 client = OpenAI(api_key=OPENAI_API_KEY)
+_token_managers = {}  # athlete id (None = legacy tokens.json) -> TokenManager
 
-def get_access_token():
-    """Load saved tokens and refresh if expired."""
-    if not os.path.exists("tokens.json"):
-        return None  # no tokens saved yet
-
-    with open("tokens.json", "r") as f:
-        tokens = json.load(f)
-
-    # Check expiry
-    import time
-    now = int(time.time())
-    if tokens.get("expires_at", 0) < now:
-        # Refresh the token
-        response = requests.post("https://www.strava.com/oauth/token", data={
-            "client_id": CLIENT_ID,
-            "client_secret": CLIENT_SECRET,
-            "grant_type": "refresh_token",
-            "refresh_token": tokens.get("refresh_token")
-        })
-        tokens = response.json()
-        # Save new tokens
-        with open("tokens.json", "w") as f:
-            json.dump(tokens, f, indent=2)
+def token_manager_for(athlete_id):
+    manager = _token_managers.get(athlete_id)
+    if manager is None:
+        with tenancy.use(athlete_id):
+            path = tenancy.path("tokens.json")
+        manager = _token_managers.setdefault(
+            athlete_id, TokenManager(path, client_id=CLIENT_ID, client_secret=CLIENT_SECRET))
+    return manager
 
-    return tokens.get("access_token")
+def get_access_token():
+    """Current athlete's access token, refreshed shortly before it expires."""
+    athlete_id = tenancy.current()
+    if athlete_id is None and not tenancy.legacy_mode():
+        return None  # not logged in
+    return token_manager_for(athlete_id).access_token()
 
 def get_recent_activities(n=10):
-    """Fetch recent activities (fallback to saved file)."""
-    if os.path.exists("activities.json"):
-        with open("activities.json", "r") as f:
-            return json.load(f)
-    return []
-
-
-def generate_stats_sticker(activity, polyline_data=None, output_path="static/sticker.png"):
-    # Transparent canvas
-    img = Image.new("RGBA", (600, 600), (255, 255, 255, 0))
-    draw = ImageDraw.Draw(img)
-
-    # Fonts
-    font_big = ImageFont.truetype("arial.ttf", 50)
-    font_small = ImageFont.truetype("arial.ttf", 30)
-
-    # Write stats
-    draw.text((50, 50), f"{activity['distance_km']} km", fill="white", font=font_big)
-    draw.text((50, 120), f"{activity['moving_time_min']} min", fill="white", font=font_small)
-    if activity.get("avg_hr"):
-        draw.text((50, 180), f"{int(activity['avg_hr'])} bpm", fill="red", font=font_small)
-
-    # If polyline → draw trace
-    if polyline_data:
-        coords = polyline.decode(polyline_data)
-        scale = 5
-        offset = (300, 300)
-        points = [(int(x*scale)+offset[0], int(y*scale)+offset[1]) for y, x in coords]
-        draw.line(points, fill="orange", width=6)
-
-    img.save(output_path, "PNG")
-    return output_path
+    """Recent activities from the local store (fallback to saved file)."""
+    rows = store.query_activities(per_page=n)
+    if rows:
+        return [{
+            "id": row["id"],
+            "name": row["name"],
+            "type": row["sport"],
+            "start_date": row["start_date_local"],
+            "distance_km": (row["distance"] or 0) / 1000,
+            "moving_time_min": (row["moving_time"] or 0) / 60,
+            "avg_hr": row["avg_hr"],
+            "avg_cadence": row["avg_cadence"],
+            "avg_power": row["avg_power"],
+            "calories": row["calories"],
+            "splits": (row["detail"] or {}).get("splits_metric", []),
+        } for row in rows]
+
+    return doccache.load(tenancy.path("activities.json"), [])
+
+
+def _date_arg_to_ts(value, end_of_day=False):
+    """Turn a YYYY-MM-DD query arg into an epoch timestamp (None if missing/invalid)."""
+    if not value:
+        return None
+    try:
+        dt = datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        return None
+    return int(dt.timestamp()) + (86400 if end_of_day else 0)
+
+
+# Reachable without a session once athletes have connected (the rest would read the root files)
+PUBLIC_ENDPOINTS = {
+    "home", "connect", "callback", "logout", "static", "metrics_endpoint",
+    "strava_webhook_challenge", "strava_webhook_event",  # checked against the subscription id
+    "calendar_ics", "photo",  # authorised by signed URLs
+}
+
+
+@app.before_request
+def bind_athlete():
+    """Route this request's reads and writes to the logged-in athlete's partition."""
+    athlete_id = session.get("athlete_id")
+    if athlete_id is not None and not tenancy.exists(athlete_id):
+        athlete_id = None
+    tenancy.activate(athlete_id)
+    tenancy.touch(athlete_id)
+    if athlete_id is None and request.endpoint not in PUBLIC_ENDPOINTS and request.endpoint is not None \
+            and not tenancy.legacy_mode():
+        if request.method == "GET":
+            return redirect(url_for("connect"))
+        return "Connect with Strava first", 401
+
+
+def calendar_key(athlete_id):
+    """Secret for an athlete's calendar feed URL (calendar apps don't send our cookie)."""
+    return hmac.new(SECRET_KEY, f"calendar:{athlete_id}".encode(), "sha256").hexdigest()[:32]
+
+
+def photo_signature(url):
+    """Keeps the photo proxy from fetching URLs this app didn't hand out."""
+    return hmac.new(SECRET_KEY, f"photo:{url}".encode(), "sha256").hexdigest()[:32]
+
+
+def proxied_photo(url, variant):
+    """Local, resized and cached URL for a Strava photo."""
+    if not url:
+        return None
+    return url_for("photo", variant=variant, src=url, sig=photo_signature(url))
+
+
+def cached_page(version, render):
+    """Serve this GET from the page cache, calling `render()` only when `version` moved.
+
+    `version` is whatever the page's data depends on (e.g. the plans version);
+    bodies go out compressed when the client allows, with an ETag for 304s.
+    """
+    key = (tenancy.current(), request.full_path, version)
+    entry = pagecache.cache.get(key)
+    metrics.cache_event("pages", entry is not None)
+    if entry is None:
+        entry = pagecache.cache.put(key, render())
+
+    encoding = pagecache.negotiate(request.accept_encodings, len(entry["bodies"]["identity"]))
+    if any(tag in request.if_none_match for tag in pagecache.etags(entry)):
+        response = app.response_class(status=304)
+    else:
+        response = app.response_class(pagecache.cache.body(entry, encoding), mimetype="text/html")
+        if encoding != "identity":
+            response.headers["Content-Encoding"] = encoding
+    response.set_etag(pagecache.etag(entry, encoding))
+    response.vary.update(("Accept-Encoding", "Cookie"))
+    # Per-athlete HTML: browsers may keep it but must check the ETag each time
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+_background_lock = threading.Lock()
+_background_started = False
+
+
+@app.before_request
+def start_background():
+    init_background()
+
+
+@app.before_request
+def start_timing():
+    g.request_start = time.perf_counter()
+    g.spans = metrics.begin_request()
+
+
+@app.after_request
+def record_timing(response):
+    start = g.pop("request_start", None)
+    if start is None:
+        return response
+    elapsed = time.perf_counter() - start
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    metrics.request_seconds.observe(elapsed, route=route, method=request.method)
+    # Streamed bodies (SSE, ICS) are timed up to the first byte
+    response.headers["Server-Timing"] = metrics.server_timing(g.spans, elapsed)
+    return response
+
+
+def _template_started(sender, template, context, **extra):
+    g.template_start = time.perf_counter()
+
+
+def _template_done(sender, template, context, **extra):
+    start = g.pop("template_start", None)
+    if start is not None:
+        elapsed = time.perf_counter() - start
+        metrics.span_seconds.observe(elapsed, span="jinja")
+        g.get("spans", []).append(("jinja", elapsed))
+
+
+before_render_template.connect(_template_started, app)
+template_rendered.connect(_template_done, app)
+
+
+@app.route("/metrics")
+def metrics_endpoint():
+    """Prometheus text exposition of this process' metrics."""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.errorhandler(strava_client.StravaError)
+def strava_error(e):
+    if e.status == 429:
+        return "Strava rate limit reached — please try again in a few minutes.", 503
+    if e.status == 404:
+        return "Activity not found on Strava.", 404
+    return f"Strava request failed: {e}", 502
 
 @app.route("/")
 def home():
     return render_template("home.html", active_page="home")
 
+@app.route("/logout")
+def logout():
+    session.pop("athlete_id", None)
+    return redirect(url_for("home"))
+
 @app.route("/connect")
 def connect():
     auth_url = (
@@ -111,37 +264,38 @@ def callback():
         return "No code returned from Strava", 400
 
     # Exchange code for token
-    token_url = "https://www.strava.com/oauth/token"
-    response = requests.post(token_url, data={
+    tokens = strava_client.post_oauth({
         "client_id": CLIENT_ID,
         "client_secret": CLIENT_SECRET,
         "code": code,
         "grant_type": "authorization_code"
     })
 
-    tokens = response.json()
+    # One partition per athlete; the first to connect inherits the single-user files
+    athlete_id = (tokens.get("athlete") or {}).get("id")
+    if athlete_id is not None:
+        legacy_tokens = doccache.load("tokens.json") or {}
+        tenancy.ensure(athlete_id, legacy_owner=(legacy_tokens.get("athlete") or {}).get("id"))
+        session["athlete_id"] = athlete_id
+        tenancy.activate(athlete_id)
+        analytics.seed_from_file(tenancy.path("activities.json"))
 
-    # --- Save tokens to a file ---
-    with open("tokens.json", "w") as f:
-        json.dump(tokens, f, indent=2)
+    # --- Save tokens (in memory + atomically to file) ---
+    token_manager_for(tenancy.current()).save(tokens)
 
     access_token = tokens.get("access_token")
 
-    # Fetch last 10 activities
-    activities_url = "https://www.strava.com/api/v3/athlete/activities"
-    r = requests.get(activities_url, headers={
-        "Authorization": f"Bearer {access_token}"
-    }, params={"per_page": 10})
-
-    activities = r.json()
+    # One page inside the redirect; page views and `flask backfill` fetch the rest
+    sync.sync_activities(access_token, max_pages=1)
+    activities = store.query_activities(per_page=10)
 
     # Display summary info
     output = "<h2>Last 10 Activities</h2><ul>"
     for act in activities:
-        name = act.get("name", "Unnamed")
-        sport = act.get("type", "Unknown")
-        dist = act.get("distance", 0) / 1000  # meters → km
-        time_min = act.get("moving_time", 0) / 60  # seconds → minutes
+        name = act.get("name") or "Unnamed"
+        sport = act.get("sport") or "Unknown"
+        dist = (act.get("distance") or 0) / 1000  # meters → km
+        time_min = (act.get("moving_time") or 0) / 60  # seconds → minutes
         output += f"<li>{sport} – {name} – {dist:.1f} km – {time_min:.0f} min</li>"
     output += "</ul>"
 
@@ -153,37 +307,49 @@ def activities():
     if not access_token:
         return '<a href="/">Connect with Strava first</a>'
 
-    # Pagination
+    sync.sync_if_stale(access_token)
+    return cached_page(store.version(), _render_activities)
+
+
+def _render_activities():
+    # Pagination + filters
     page = int(request.args.get("page", 1))
     per_page = 20  # show 20 per page
-
-    activities_url = "https://www.strava.com/api/v3/athlete/activities"
-    r = requests.get(
-        activities_url,
-        headers={"Authorization": f"Bearer {access_token}"},
-        params={"per_page": per_page, "page": page}
+    sport = request.args.get("sport") or None
+    sort = request.args.get("sort", "date")
+    start_ts = _date_arg_to_ts(request.args.get("from"))
+    end_ts = _date_arg_to_ts(request.args.get("to"), end_of_day=True)
+
+    activities = store.query_activities(
+        page=page, per_page=per_page, sport=sport,
+        start_ts=start_ts, end_ts=end_ts,
+        sort=sort, descending=request.args.get("order", "desc") != "asc",
     )
-    activities = r.json()
 
     # Parse into clean dicts
     table_data = []
     for act in activities:
         table_data.append({
-            "id": act.get("id"),
-            "name": act.get("name"),
-            "sport": act.get("type"),
-            "date": act.get("start_date_local"),
-            "duration_min": round(act.get("moving_time", 0) / 60),
-            "distance_km": round(act.get("distance", 0) / 1000, 2),
-            "avg_hr": act.get("average_heartrate"),
-            "avg_cadence": act.get("average_cadence"),
+            "id": act["id"],
+            "name": act["name"],
+            "sport": act["sport"],
+            "date": act["start_date_local"],
+            "duration_min": round((act["moving_time"] or 0) / 60),
+            "distance_km": round((act["distance"] or 0) / 1000, 2),
+            "avg_hr": act["avg_hr"],
+            "avg_cadence": act["avg_cadence"],
         })
 
+    filters = {k: v for k, v in request.args.items() if k != "page" and v}
+
     return render_template(
         "activities.html",
         activities=table_data,
         page=page,
         per_page=per_page,
+        has_next=len(table_data) == per_page,
+        sports=store.list_sports(),
+        filters=filters,
         active_page="activities"
     )
 
@@ -194,9 +360,8 @@ def activity_detail(activity_id):
     if not access_token:
         return '<a href="/">Connect with Strava first</a>'
 
-    # Fetch detailed info
-    detail_url = f"https://www.strava.com/api/v3/activities/{activity_id}"
-    detail = requests.get(detail_url, headers={"Authorization": f"Bearer {access_token}"}).json()
+    # Detailed info (fetched from Strava once, then served locally)
+    detail = sync.get_activity_detail(access_token, activity_id)
 
     # Extract relevant details
     act = {
@@ -210,48 +375,65 @@ def activity_detail(activity_id):
         "avg_cadence": detail.get("average_cadence"),
         "avg_power": detail.get("average_watts"),
         "calories": detail.get("calories"),
-        "map_polyline": detail.get("map", {}).get("summary_polyline"),   # 🚨 add this
+        "map_polyline": geometry.route_variant(
+            detail.get("id"), detail.get("map", {}).get("summary_polyline"), "detail"),
         "photos": detail.get("photos", {}).get("primary"),               # 🚨 add this
     }
 
     return render_template("activity_detail.html", activity=act, active_page="activities")
 
+@app.route("/activities/<int:activity_id>/streams.json")
+def activity_streams(activity_id):
+    """Downsampled heart rate/altitude/speed/... series for the detail page charts."""
+    access_token = get_access_token()
+    if not access_token:
+        return {"error": "not connected"}, 401
+
+    # Streams are downloaded once and then read from the memory-mapped files
+    streams.fetch(access_token, activity_id)
+    points = min(max(request.args.get("points", streams.CHART_POINTS, type=int), 10), 5000)
+    response = app.json.response({"series": streams.chart_data(activity_id, points)})
+    response.cache_control.private = True
+    response.cache_control.max_age = 3600
+    return response
+
 @app.route("/share/<int:activity_id>")
 def share_preview(activity_id):
     access_token = get_access_token()
     if not access_token:
         return redirect(url_for("connect"))
 
-    # Fetch activity details
-    detail_url = f"https://www.strava.com/api/v3/activities/{activity_id}?include_all_efforts=false"
-    detail = requests.get(detail_url, headers={"Authorization": f"Bearer {access_token}"}).json()
+    # Activity details (served locally once fetched) and photos, in parallel;
+    # the page still renders without photos if that call is slow or fails
+    results = strava_client.fetch_concurrently({
+        "detail": lambda: sync.get_activity_detail(access_token, activity_id),
+        "photos": lambda: strava_client.get(f"/activities/{activity_id}/photos", access_token),
+    }, timeouts={"detail": 8, "photos": 3}, required=("detail",))
+    detail = results["detail"]
 
-    # Collect all images
-    images = []
+    # Collect all images: a small one for the picker, a full-size one for the preview
+    sources = []
     if detail.get("photos", {}).get("primary"):
-        images.append(list(detail["photos"]["primary"]["urls"].values())[0])
-
-    if detail.get("photos", {}).get("count", 0) > 1:
-        # Fetch all uploaded photos
-        photos_url = f"https://www.strava.com/api/v3/activities/{activity_id}/photos"
-        photo_resp = requests.get(
-            photos_url, headers={"Authorization": f"Bearer {access_token}"}
-        ).json()
-        for p in photo_resp:
+        sources.append(photos.source_url(detail["photos"]["primary"]["urls"]))
+
+    if detail.get("photos", {}).get("count", 0) > 1 and results["photos"]:
+        for p in results["photos"]:
             if p.get("urls"):
-                images.append(list(p["urls"].values())[0])
+                sources.append(photos.source_url(p["urls"]))
+    images = [{"thumb": proxied_photo(src, "thumb"), "full": proxied_photo(src, "full")}
+              for src in sources if src]
 
-    # Add map preview if available
+    # Add map preview if available (pre-rendered locally, no external map service)
     if detail.get("map", {}).get("summary_polyline"):
-        map_url = (
-            f"https://maps.googleapis.com/maps/api/staticmap"
-            f"?size=1080x1080&path=enc:{detail['map']['summary_polyline']}&key=YOUR_API_KEY"
-        )
-        images.insert(0, map_url)  # put map first in the list
+        images.insert(0, {  # put map first in the list
+            "thumb": url_for("route_thumbnail", activity_id=activity_id, size="sm", fmt="png"),
+            "full": url_for("route_thumbnail", activity_id=activity_id, size="lg", fmt="png"),
+        })
 
     # Fallback placeholder if no images at all
     if not images:
-        images.append(url_for("static", filename="map_placeholder.png"))
+        placeholder = url_for("static", filename="map_placeholder.png")
+        images.append({"thumb": placeholder, "full": placeholder})
 
     # Pack activity stats
     act = {
@@ -268,96 +450,189 @@ def share_preview(activity_id):
     return render_template(
         "share_preview.html",
         activity=act,
-        preview_image=images[0],  # first image shown initially
+        preview_image=images[0]["full"],  # first image shown initially
         images=images,
         active_page="aura"
     )
 
 
+def load_profile():
+    return doccache.load(tenancy.path("profile.json"))
+
+
+def training_summary():
+    """Numeric load/zone summary over the whole split history, for prompts."""
+    return analytics.summary_text(load_profile(), int(datetime.now().timestamp()))
+
+
+def generate_plan(day):
+    """Ask the LLM for a structured plan; runs on the plan worker, not a request thread."""
+    activities = get_recent_activities(10)
+    if not activities:
+        raise ValueError("No activities to base a plan on yet")
+
+    day = date.fromisoformat(str(day))
+    previous_plan = plan_store.get_plan(day - timedelta(days=1))
+    # Ask GPT for a structured JSON plan (identical prompts are answered from cache;
+    # the date is part of the prompt, so days never share an answer)
+    content = llm_cache.complete(
+        client,
+        model="gpt-4o-mini",
+        messages=prompts.build_plan_messages(load_profile(), activities, training_summary(),
+                                             day=day, previous_plan=previous_plan),
+        response_format={ "type": "json_object" }
+    )
+    return json.loads(content)
+
+
+if tenancy.legacy_mode():
+    analytics.seed_from_file()
+
+
+def init_background():
+    """Start the serving process's background work: plan pre-warming and the webhook worker.
+
+    Runs on the first request rather than at import, so CLI commands
+    (`flask backfill`, `flask subscribe-webhook`) and sticker render workers
+    don't generate plans or claim webhook events.
+    """
+    global _background_started
+    with _background_lock:
+        if _background_started:
+            return
+        _background_started = True
+        plan_worker.start(generate_plan)
+        # New activities change tomorrow's context, so get its plan going right away
+        sync.on_new_activities.append(plan_worker.prewarm)
+        webhooks.start(get_access_token)
+
+
+@app.route("/webhooks/strava", methods=["GET"])
+def strava_webhook_challenge():
+    """Subscription handshake: echo hub.challenge back if the verify token matches."""
+    if not webhooks.verify(request.args.get("hub.mode"), request.args.get("hub.verify_token")):
+        return "Verification failed", 403
+    return {"hub.challenge": request.args.get("hub.challenge")}
+
+
+@app.route("/webhooks/strava", methods=["POST"])
+def strava_webhook_event():
+    """Strava expects a 200 within 2 seconds: queue the event, process it later."""
+    event = request.get_json(silent=True)
+    if not isinstance(event, dict) or "object_id" not in event:
+        return "Bad event", 400
+    if not webhooks.authentic(event):
+        return "Unknown subscription", 403
+    webhooks.enqueue(event)
+    return "", 200
+
+
+@app.route("/sticker/<int:activity_id>.png")
+def sticker(activity_id):
+    access_token = get_access_token()
+    if not access_token:
+        return redirect(url_for("connect"))
+
+    detail = sync.get_activity_detail(access_token, activity_id)
+    stats = {
+        "distance_km": round(detail.get("distance", 0) / 1000, 2),
+        "moving_time_min": round(detail.get("moving_time", 0) / 60),
+        "avg_hr": detail.get("average_heartrate"),
+    }
+    path = stickers.get_sticker(activity_id, stats, (detail.get("map") or {}).get("summary_polyline"))
+    response = send_file(os.path.abspath(path), mimetype="image/png", max_age=86400)
+    response.cache_control.public = None  # one athlete's stats
+    response.cache_control.private = True
+    return response
+
+
+@app.route("/thumbs/<int:activity_id>/<size>.<fmt>")
+def route_thumbnail(activity_id, size, fmt):
+    if size not in thumbnails.SIZES or fmt not in thumbnails.FORMATS:
+        return "Unknown thumbnail size or format", 404
+    act = store.get_activity(activity_id)
+    if not act or not act["summary_polyline"]:
+        return "No route for this activity", 404
+
+    # Answer revalidations without touching the image at all
+    tag = thumbnails.etag(act["summary_polyline"], size, fmt)
+    if tag in request.if_none_match:
+        response = app.response_class(status=304)
+    else:
+        path = thumbnails.get_thumbnail(activity_id, act["summary_polyline"], size, fmt)
+        response = send_file(os.path.abspath(path), mimetype=thumbnails.FORMATS[fmt][1], conditional=False, etag=False)
+    response.set_etag(tag)
+    response.cache_control.no_cache = None
+    response.cache_control.private = True  # one athlete's route
+    response.cache_control.max_age = 86400
+    return response
+
+
+@app.route("/photos/<variant>.jpg")
+def photo(variant):
+    if variant not in photos.VARIANTS:
+        return "Unknown photo variant", 404
+    url = request.args.get("src", "")
+    if not url or not hmac.compare_digest(request.args.get("sig", ""), photo_signature(url)):
+        return "Invalid photo link", 403
+
+    # Variants never change for a given source URL: cache them for good
+    tag = photos.etag(url, variant)
+    if tag in request.if_none_match:
+        response = app.response_class(status=304)
+    else:
+        try:
+            path = photos.get_photo(url, variant)
+        except photos.PhotoError:
+            return "Photo unavailable", 502
+        response = send_file(os.path.abspath(path), mimetype="image/jpeg", conditional=False, etag=False)
+    response.set_etag(tag)
+    response.cache_control.no_cache = None
+    response.cache_control.public = True
+    response.cache_control.max_age = 365 * 86400
+    response.cache_control.immutable = True
+    return response
+
+
 @app.route("/coach")
 def coach():
     today = str(date.today())
 
-    # Load athlete profile
-    profile_text = ""
-    if os.path.exists("profile.json"):
-        with open("profile.json", "r") as f:
-            profile = json.load(f)
-        profile_text = f"Athlete profile: {json.dumps(profile)}"
-
-    # Load existing plan file if it exists
-    plan_file = "plan.json"
-    if os.path.exists(plan_file):
-        with open(plan_file, "r") as f:
-            plans = json.load(f)
-    else:
-        plans = {}
-
     # If today's plan already exists, reuse it
-    if today in plans:
-        plan = plans[today]
-        return render_template(
+    plan = plan_worker.get_plan(today)
+    if plan is not None:
+        return cached_page((plan_store.version(), today), lambda: render_template(
             "coach.html",
             advice=plan,
             active_page="coach",
             source="Saved Plan"
-        )
+        ))
 
-    # Otherwise → generate a new plan with OpenAI
-    if not os.path.exists("activities.json"):
+    if not get_recent_activities(1):
         return '<p>No detailed activities found. Visit <a href="/activities">/activities</a> first.</p>'
 
-    with open("activities.json", "r") as f:
-        activities = json.load(f)
-
-    # Build a summary of last workouts
-    summary = ""
-    for a in activities:
-        summary += (
-            f"{a['type']} – {a['name']} – {a['distance_km']:.1f} km – "
-            f"{a['moving_time_min']:.0f} min"
-        )
-        if a.get("avg_hr"):
-            summary += f" – HR {a['avg_hr']:.0f} bpm"
-        if a.get("avg_cadence"):
-            summary += f" – Cadence {a['avg_cadence']:.0f}"
-        if a.get("avg_power"):
-            summary += f" – Power {a['avg_power']:.0f} W"
-        summary += "\n"
-
-    # Ask GPT for a structured JSON plan
-    completion = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": "You are Cadence, an AI triathlon coach. Output ONLY valid JSON with keys: sport, duration_min, intensity, rationale."},
-            {"role": "user", "content": f"{profile_text}\nHere are my last workouts:\n{summary}\n\nGenerate tomorrow's training plan."}
-        ],
-        response_format={ "type": "json_object" }
-    )
-
-    plan = json.loads(completion.choices[0].message.content)
-
-    # Save the plan into plan.json
-    plans[today] = plan
-    with open(plan_file, "w") as f:
-        json.dump(plans, f, indent=2)
+    # Otherwise → queue generation (deduplicated per date) and show progress
+    error = None if request.args.get("retry") else plan_worker.last_error(today)
+    if error is None:
+        plan_worker.enqueue(today)
 
     return render_template(
         "coach.html",
-        advice=plan,
+        advice=None,
+        generating=error is None,
+        error=error,
         active_page="coach",
-        source="New Plan"
+        source="Generating"
     )
 
 
 @app.route("/profile", methods=["GET", "POST"])
 def profile():
-    profile_file = "profile.json"
+    profile_file = tenancy.path("profile.json")
 
     # Load current profile (initialize empty structured dict if not found)
     if os.path.exists(profile_file):
-        with open(profile_file, "r") as f:
-            profile = json.load(f)
+        profile = doccache.load(profile_file)
     else:
         profile = {
             "identity": {},
@@ -372,6 +647,7 @@ def profile():
 
     # Save updates from form
     if request.method == "POST":
+        profile = copy.deepcopy(profile)  # the cached copy is shared; edit our own
         profile["identity"]["name"] = request.form.get("name")
         profile["identity"]["dob"] = request.form.get("dob")
         profile["identity"]["sex"] = request.form.get("sex")
@@ -403,9 +679,8 @@ def profile():
         profile["equipment"]["bike"] = request.form.get("bike")
         profile["equipment"]["sensors"] = request.form.get("sensors")
 
-        # Save to file
-        with open(profile_file, "w") as f:
-            json.dump(profile, f, indent=2)
+        # Save to file (write-through to the document cache)
+        doccache.save(profile_file, profile)
 
     return render_template("profile.html", profile=profile, active_page="profile")
 
@@ -416,17 +691,17 @@ def schedule():
     import calendar
     from datetime import date
 
-    plan_file = "plan.json"
-    if os.path.exists(plan_file):
-        with open(plan_file, "r") as f:
-            plans = json.load(f)
-    else:
-        plans = {}
-
     # Get year/month from query params or fallback to today
     today = date.today()
     year = int(request.args.get("year", today.year))
     month = int(request.args.get("month", today.month))
+    return cached_page((plan_store.version(), year, month), lambda: _render_schedule(year, month))
+
+
+def _render_schedule(year, month):
+    # Only this month's plans (indexed range query on the date key)
+    next_first = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+    plans = plan_store.plans_between(date(year, month, 1), next_first)
 
     cal = calendar.Calendar(firstweekday=6).monthdayscalendar(year, month)
 
@@ -445,91 +720,89 @@ def schedule():
         prev_month=prev_month,
         next_year=next_year,
         next_month=next_month,
+        calendar_url=url_for("calendar_ics", athlete=tenancy.current(), key=calendar_key(tenancy.current()))
+        if tenancy.current() is not None else url_for("calendar_ics"),
         active_page="schedule"
     )
 
 
 @app.route("/calendar.ics")
 def calendar_ics():
-    plan_file = "plan.json"
-    if not os.path.exists(plan_file):
+    # Subscribed calendar apps identify the athlete by a signed URL instead of the session
+    athlete_id = request.args.get("athlete", type=int)
+    if athlete_id is not None:
+        if not tenancy.exists(athlete_id) or not hmac.compare_digest(
+                request.args.get("key", ""), calendar_key(athlete_id)):
+            return "Invalid calendar link", 403
+        tenancy.activate(athlete_id)
+    elif tenancy.current() is None and not tenancy.legacy_mode():
+        return "Connect with Strava first", 401
+
+    # Optional ?start=YYYY-MM-DD&end=YYYY-MM-DD window (end exclusive);
+    # by default the last 90 days and everything ahead
+    start = request.args.get("start") or str(date.today() - timedelta(days=90))
+    end = request.args.get("end")
+    try:
+        start = str(date.fromisoformat(start))
+        end = str(date.fromisoformat(end)) if end else None
+    except ValueError:
+        return "start/end must be YYYY-MM-DD", 400
+
+    if not plan_store.count_plans():
         return "No plans found", 404
 
-    with open(plan_file, "r") as f:
-        plans = json.load(f)
-
-    ics = "BEGIN:VCALENDAR\nVERSION:2.0\n"
-    for date_str, plan in plans.items():
-        dt = datetime.strptime(date_str, "%Y-%m-%d")
-        start = dt.strftime("%Y%m%dT070000")  # default 7 AM start
-        duration = f"PT{plan['duration_min']}M"
-
-        ics += "BEGIN:VEVENT\n"
-        ics += f"DTSTART:{start}\n"
-        ics += f"DURATION:{duration}\n"
-        ics += f"SUMMARY:{plan['sport']} — {plan['intensity']}\n"
-        ics += f"DESCRIPTION:{plan['rationale']}\n"
-        ics += "END:VEVENT\n"
-
-    ics += "END:VCALENDAR\n"
+    # Validators come from the plan store's write counter, so polling
+    # subscribers get a 304 without the feed being generated at all
+    etag = f"plans-{tenancy.current()}-v{plan_store.version()}-{start}-{end or ''}"
+    last_modified = datetime.fromtimestamp(plan_store.last_modified() or 0, tz=timezone.utc)
+    if request.if_none_match:
+        not_modified = etag in request.if_none_match
+    else:
+        not_modified = bool(request.if_modified_since) and request.if_modified_since >= last_modified.replace(microsecond=0)
 
-    return app.response_class(ics, mimetype="text/calendar")
+    if not_modified:
+        response = app.response_class(status=304)
+    else:
+        rows = plan_store.iter_plans_between(start, end)
+        response = app.response_class(stream_with_context(ics.generate(rows)), mimetype="text/calendar")
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    # A session-identified feed is one athlete's data behind a shared URL
+    if athlete_id is None and tenancy.current() is not None:
+        response.cache_control.private = True
+    else:
+        response.cache_control.public = True
+    response.cache_control.max_age = 300
+    return response
+
+def build_chat_messages(history):
+    """System prompt + budgeted athlete context, history relevant to the question and the last few turns."""
+    retrieved = retrieval.search(history[-1]["content"], prompts.RETRIEVAL_K, exclude=history) if history else []
+    return prompts.build_chat_messages(
+        load_profile(), plan_store.recent_plans(prompts.PLAN_CONTEXT_LIMIT), get_recent_activities(10), history,
+        training_summary(), retrieved
+    )
 
 @app.route("/chat", methods=["GET", "POST"])
 def chat():
-    history_file = "chat_history.json"
-
-    # Load history
-    if os.path.exists(history_file):
-        with open(history_file, "r") as f:
-            history = json.load(f)
-    else:
-        history = []
+    # Only the tail of the journal is read; older turns never enter the prompt
+    history = chat_journal.tail(10)
 
     if request.method == "POST":
         user_msg = request.form.get("message")
         if user_msg:
             history.append({"role": "user", "content": user_msg})
 
-            # Context: profile + plan + recent activities
-            context = ""
-            if os.path.exists("profile.json"):
-                with open("profile.json", "r") as f:
-                    profile = json.load(f)
-                context += f"Athlete profile: {json.dumps(profile)}\n"
-
-            if os.path.exists("plan.json"):
-                with open("plan.json", "r") as f:
-                    plan = json.load(f)
-                context += f"Current plan: {json.dumps(plan)}\n"
-
-            recent = get_recent_activities(10)
-            if recent:
-                context += "Recent activities (last 10):\n"
-                for act in recent:
-                    context += (
-                        f"- {act.get('type')} {act.get('name')} | "
-                        f"{act.get('distance_km',0):.1f} km, "
-                        f"{act.get('moving_time_min',0):.0f} min, "
-                        f"HR {act.get('avg_hr','?')}, "
-                        f"Cadence {act.get('avg_cadence','?')}\n"
-                    )
-
             # Ask GPT with full context
-            completion = client.chat.completions.create(
+            reply = llm_cache.complete(
+                client,
                 model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": "You are Cadence, an AI triathlon coach. Analyze athlete data and answer clearly with safe, supportive guidance."},
-                    {"role": "user", "content": context},
-                ] + history[-5:]
+                messages=build_chat_messages(history)
             )
-
-            reply = completion.choices[0].message.content
             history.append({"role": "assistant", "content": reply})
 
-            # Save
-            with open(history_file, "w") as f:
-                json.dump(history, f, indent=2)
+            # Save (one atomic append to the journal)
+            chat_journal.append(history[-2:])
 
     # Render simple UI
     html = """
@@ -551,31 +824,94 @@ def chat():
     """
     return render_template("chat.html", history=history[-10:], active_page="chat")
 
+
+@app.route("/chat/stream", methods=["POST"])
+def chat_stream():
+    """Same as POST /chat, but the reply is streamed to the browser as Server-Sent Events."""
+    user_msg = request.form.get("message") or (request.get_json(silent=True) or {}).get("message")
+    if not user_msg:
+        return "Missing message", 400
+
+    history = chat_journal.tail(10)
+    history.append({"role": "user", "content": user_msg})
+    messages = build_chat_messages(history)
+    key = llm_cache.fingerprint("gpt-4o-mini", messages)
+    cached = llm_cache.cache.get(key)
+    metrics.cache_event("llm", cached is not None)
+
+    def replay():
+        chat_journal.append([
+            {"role": "user", "content": user_msg},
+            {"role": "assistant", "content": cached},
+        ])
+        yield f"data: {json.dumps({'token': cached})}\n\n"
+        yield "event: done\ndata: {}\n\n"
+
+    if cached is not None:
+        return Response(replay(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+    with metrics.span("openai"):  # time to response headers; the token stream follows
+        stream = client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=messages,
+            stream=True,
+        )
+
+    def generate():
+        parts = []
+        finished = False
+        try:
+            for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    parts.append(delta)
+                    yield f"data: {json.dumps({'token': delta})}\n\n"
+            finished = True
+            llm_cache.cache.put(key, "".join(parts))
+            chat_journal.append([
+                {"role": "user", "content": user_msg},
+                {"role": "assistant", "content": "".join(parts)},
+            ])
+            yield "event: done\ndata: {}\n\n"
+        finally:
+            # Client went away mid-stream: close the upstream HTTP response
+            # so OpenAI stops generating (and billing) tokens nobody will read
+            if not finished:
+                stream.close()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @app.route("/aura")
 def aura():
     access_token = get_access_token()
     if not access_token:
         return redirect(url_for("connect"))
 
-    # Fetch last 20 activities with photos
-    r = requests.get(
-        "https://www.strava.com/api/v3/athlete/activities",
-        headers={"Authorization": f"Bearer {access_token}"},
-        params={"per_page": 20, "page": 1}
-    )
-    activities = r.json()
+    sync.sync_if_stale(access_token)
+    return cached_page(store.version(), _render_aura)
+
+
+def _render_aura():
+    # Last 20 activities from the local store
+    activities = store.query_activities(page=1, per_page=20)
 
     # Preprocess: include photos + polyline
     acts = []
-    for act in activities:
+    for row in activities:
+        act = row["detail"] or row["summary"] or {}
         acts.append({
-            "id": act["id"],
-            "name": act.get("name"),
-            "type": act.get("type"),
-            "distance_km": round(act.get("distance", 0)/1000, 2),
-            "moving_time_min": round(act.get("moving_time", 0)/60),
-            "map_polyline": act.get("map", {}).get("summary_polyline"),
-            "photos": act.get("photos", {}).get("primary", {}).get("urls") if act.get("photos") else None
+            "id": row["id"],
+            "name": row["name"],
+            "type": row["sport"],
+            "distance_km": round((row["distance"] or 0)/1000, 2),
+            "moving_time_min": round((row["moving_time"] or 0)/60),
+            "has_route": bool(row["summary_polyline"]),
+            "photo": proxied_photo(photos.source_url(((act.get("photos") or {}).get("primary") or {}).get("urls")),
+                                   "card"),
         })
 
     return render_template("aura.html", activities=acts, active_page="aura")
@@ -587,16 +923,15 @@ def aura_preview(activity_id):
     if not access_token:
         return '<a href="/">Connect with Strava first</a>'
 
-    # Fetch activity detail
-    detail_url = f"https://www.strava.com/api/v3/activities/{activity_id}"
-    detail = requests.get(detail_url, headers={"Authorization": f"Bearer {access_token}"}).json()
-
-    # Fetch photos
-    photos_url = f"https://www.strava.com/api/v3/activities/{activity_id}/photos"
-    photos = requests.get(photos_url, headers={"Authorization": f"Bearer {access_token}"},
-                          params={"size": 1000}).json()
-
-    photo_url = photos[0]["urls"]["1000"] if photos else None
+    # Activity detail (served locally once fetched) and photos, in parallel;
+    # a slow photos call falls back to the photo-less card
+    results = strava_client.fetch_concurrently({
+        "detail": lambda: sync.get_activity_detail(access_token, activity_id),
+        "photos": lambda: strava_client.get(f"/activities/{activity_id}/photos", access_token,
+                                            params={"size": 1000}),
+    }, timeouts={"detail": 8, "photos": 3}, required=("detail",))
+    detail = results["detail"]
+    photo_url = proxied_photo(photos.source_url(results["photos"][0]["urls"]), "full") if results["photos"] else None
 
     act = {
         "name": detail.get("name"),
@@ -609,5 +944,40 @@ def aura_preview(activity_id):
 
     return render_template("aura_preview.html", activity=act, active_page="aura")
 
+
+@app.cli.command("subscribe-webhook")
+@click.argument("callback_url")
+def subscribe_webhook_command(callback_url):
+    """Subscribe CALLBACK_URL (…/webhooks/strava) to Strava push events; run while the app is up."""
+    subscription = webhooks.subscribe(callback_url, CLIENT_ID, CLIENT_SECRET)
+    click.echo(f"Subscribed (id {subscription}); events for other subscriptions are rejected")
+
+
+@app.cli.command("backfill")
+@click.option("--workers", default=backfill.WORKERS, show_default=True, help="Concurrent Strava requests.")
+@click.option("--details/--no-details", default=False, help="Also fetch splits for every activity.")
+@click.option("--streams", "with_streams", is_flag=True, help="Also download full-resolution streams.")
+@click.option("--limit", type=int, default=None, help="Max details/streams to fetch in this run.")
+@click.option("--restart", is_flag=True, help="Re-import summaries even if a backfill already finished.")
+@click.option("--athlete", type=int, default=None, help="Athlete id (required once athletes have connected).")
+def backfill_command(workers, details, with_streams, limit, restart, athlete):
+    """Import the athlete's full Strava history (resumes after interruption)."""
+    if athlete is None and not tenancy.legacy_mode():
+        raise click.UsageError("--athlete is required; known athletes: "
+                               + ", ".join(map(str, sorted(tenancy.athletes()))))
+    if athlete is not None and not tenancy.exists(athlete):
+        raise click.UsageError(f"No athlete {athlete} on this node")
+    tenancy.activate(athlete)
+    access_token = get_access_token()
+    progress = backfill.Progress()
+    report = lambda p: click.echo(f"\r{p.report()}", nl=False)
+    backfill.backfill_summaries(access_token, workers, progress, on_progress=report, restart=restart)
+    if details:
+        backfill.backfill_details(access_token, workers, limit, progress, on_progress=report)
+    if with_streams:
+        backfill.backfill_streams(access_token, workers, limit, progress, on_progress=report)
+    click.echo(f"\rDone: {progress.report()}")
+
+
 if __name__ == "__main__":
     app.run(debug=True)
@@ -0,0 +1,166 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import analytics
+import store
+import strava_client
+import streams
+import tenancy
+
+PAGE_SIZE = 200  # Strava's maximum per_page
+WORKERS = 4
+WRITE_BATCH = 1000  # rows per store transaction
+RATE_WAIT = 900  # block up to a full 15-minute window for rate-limit budget
+STATE_KEY = "backfill"
+
+
+class Progress:
+    """Counters for the throughput report."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.requests = 0
+        self.activities = 0
+        self.details = 0
+        self.streams = 0
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def report(self):
+        elapsed = max(self.elapsed, 1e-6)
+        return (f"{self.activities} activities, {self.details} details, {self.streams} streams, "
+                f"{self.requests} requests "
+                f"in {elapsed:.1f}s ({self.activities / elapsed:.1f} activities/s, "
+                f"{self.requests / elapsed:.1f} req/s)")
+
+
+def _fetch_page(access_token, before, page):
+    return strava_client.get(
+        "/athlete/activities", access_token,
+        params={"before": before, "per_page": PAGE_SIZE, "page": page},
+        use_cache=False, max_wait=RATE_WAIT,
+    )
+
+
+def _load_state(restart=False):
+    state = store.get_state(STATE_KEY)
+    if not state or restart:
+        # Anchor paging at "now" so activities added meanwhile don't shift pages
+        state = {"before": int(time.time()), "pages_done": [], "last_page": None, "finished": False}
+    return state
+
+
+def _next_pages(done, last_page, count):
+    """The first `count` page numbers not fetched yet (bounded once the last page is known)."""
+    pages, page = [], 1
+    while len(pages) < count and (last_page is None or page <= last_page):
+        if page not in done:
+            pages.append(page)
+        page += 1
+    return pages
+
+
+def backfill_summaries(access_token, workers=WORKERS, progress=None, on_progress=None, restart=False):
+    """Page through the athlete's whole history, `workers` pages at a time.
+
+    Progress is checkpointed in the store after every written batch, so an
+    interrupted run only refetches the pages it hadn't written yet. Once
+    finished, incremental sync keeps the store current and reruns are no-ops
+    unless `restart` is set.
+    """
+    progress = progress or Progress()
+    state = _load_state(restart)
+    if state["finished"]:
+        return progress
+    done = set(state["pages_done"])
+    rows, pages = [], []
+
+    def flush():
+        if pages:
+            progress.activities += store.upsert_activities(rows)
+            done.update(pages)
+            state["pages_done"] = sorted(done)
+            store.set_state(STATE_KEY, state)
+            rows.clear()
+            pages.clear()
+            if on_progress:
+                on_progress(progress)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="backfill") as pool:
+        try:
+            while True:
+                wave = _next_pages(done | set(pages), state["last_page"], workers)
+                if not wave:
+                    break
+                futures = [(page, pool.submit(_fetch_page, access_token, state["before"], page))
+                           for page in wave]
+                for page, future in futures:
+                    batch = future.result()
+                    progress.requests += 1
+                    if len(batch) < PAGE_SIZE:
+                        # A short page is the end of history (keep the earliest one seen)
+                        last = page if batch else page - 1
+                        if state["last_page"] is None or last < state["last_page"]:
+                            state["last_page"] = last
+                    rows.extend(batch)
+                    pages.append(page)
+                if len(rows) >= WRITE_BATCH:
+                    flush()
+        finally:
+            flush()
+
+    state["finished"] = True
+    store.set_state(STATE_KEY, state)
+    return progress
+
+
+def _fetch_detail(access_token, activity_id):
+    try:
+        return strava_client.get(
+            f"/activities/{activity_id}", access_token,
+            params={"include_all_efforts": "false"}, max_wait=RATE_WAIT,
+        )
+    except strava_client.StravaError as e:
+        if e.status == 404:  # deleted since the summary was listed
+            return None
+        raise
+
+
+def backfill_details(access_token, workers=WORKERS, limit=None, progress=None, on_progress=None):
+    """Fetch details (splits) for stored activities that don't have one yet.
+
+    The detail column itself is the checkpoint: a rerun only asks for what's missing.
+    """
+    progress = progress or Progress()
+    ids = store.ids_without_detail(limit)
+    batch_size = max(workers * 25, 50)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="backfill") as pool:
+        for i in range(0, len(ids), batch_size):
+            chunk = ids[i:i + batch_size]
+            details = [d for d in pool.map(tenancy.bind(lambda activity_id: _fetch_detail(access_token, activity_id)), chunk) if d]
+            progress.requests += len(chunk)
+            progress.details += store.save_details(details)
+            analytics.append_activities(
+                (d["id"], store.iso_to_ts(d.get("start_date")), d.get("type"), d.get("splits_metric") or [])
+                for d in details
+            )
+            if on_progress:
+                on_progress(progress)
+    return progress
+
+
+def backfill_streams(access_token, workers=WORKERS, limit=None, progress=None, on_progress=None):
+    """Download streams for stored activities that have none on disk yet."""
+    progress = progress or Progress()
+    ids = [i for i in store.all_ids() if not streams.has_streams(i)][:limit]
+    batch_size = max(workers * 25, 50)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="backfill") as pool:
+        for i in range(0, len(ids), batch_size):
+            chunk = ids[i:i + batch_size]
+            progress.streams += sum(pool.map(tenancy.bind(lambda activity_id: streams.fetch(access_token, activity_id)), chunk))
+            progress.requests += len(chunk)
+            if on_progress:
+                on_progress(progress)
+    return progress
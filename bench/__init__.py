@@ -0,0 +1 @@
+"""Load-test benchmarks against local Strava/OpenAI stand-ins (see bench/run.py)."""
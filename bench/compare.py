@@ -0,0 +1,64 @@
+"""Compare two benchmark results route by route.
+
+    python -m bench.compare bench/results/before.json bench/results/after.json [--fail-over 10]
+
+Exits with status 1 when `--fail-over` is given and any route's p95 got worse
+by more than that many percent.
+"""
+import sys
+import json
+import argparse
+
+METRICS = ("p50_ms", "p95_ms", "p99_ms", "throughput_rps")
+
+
+def _delta(before, after):
+    if not before:
+        return float("nan")
+    return (after - before) / before * 100
+
+
+def compare(before, after):
+    """Rows of (route, metric, before, after, % change) for routes present in both."""
+    rows = []
+    for route in sorted(set(before["routes"]) & set(after["routes"])):
+        b, a = before["routes"][route], after["routes"][route]
+        for metric in METRICS:
+            rows.append((route, metric, b[metric], a[metric], _delta(b[metric], a[metric])))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--fail-over", type=float, default=None, help="max allowed p95 regression in percent")
+    args = parser.parse_args()
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+
+    print(f"{before['meta']['label']} ({before['meta']['git_rev']}) -> "
+          f"{after['meta']['label']} ({after['meta']['git_rev']})")
+    if before["meta"]["config"] != after["meta"]["config"]:
+        print("warning: runs used different configurations; deltas may not be comparable")
+
+    print(f"{'route':<24}{'metric':<16}{'before':>10}{'after':>10}{'change':>10}")
+    regressions = []
+    for route, metric, b, a, change in compare(before, after):
+        print(f"{route:<24}{metric:<16}{b:>10.1f}{a:>10.1f}{change:>+9.1f}%")
+        if metric == "p95_ms" and args.fail_over is not None and change > args.fail_over:
+            regressions.append(route)
+
+    for route in sorted(set(before["routes"]) ^ set(after["routes"])):
+        print(f"{route:<24}only in {'before' if route in before['routes'] else 'after'}")
+
+    if regressions:
+        print(f"\np95 regressed by more than {args.fail_over}%: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+TIMEOUT = 60
+
+
+def _parse_server_timing(header):
+    """{name: milliseconds} from a Server-Timing header."""
+    spans = {}
+    for part in (header or "").split(","):
+        fields = [f.strip() for f in part.split(";")]
+        name = fields[0]
+        for field in fields[1:]:
+            if field.startswith("dur="):
+                try:
+                    spans[name] = spans.get(name, 0.0) + float(field[4:])
+                except ValueError:
+                    pass
+    return spans
+
+
+def drive(base_url, method, paths, total, concurrency, data=None):
+    """Issue `total` requests (cycling through `paths`) from `concurrency` threads.
+
+    Returns (samples, elapsed) where each sample is (seconds, status, server_timing).
+    """
+    local = threading.local()
+    counter = iter(range(total))
+    counter_lock = threading.Lock()
+    samples = []
+    samples_lock = threading.Lock()
+
+    def session():
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        return local.session
+
+    def worker():
+        while True:
+            with counter_lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            url = base_url + paths[i % len(paths)]
+            payload = data(i) if callable(data) else data
+            start = time.perf_counter()
+            try:
+                r = session().request(method, url, data=payload, timeout=TIMEOUT)
+                r.content  # include body transfer (streamed responses too)
+                sample = (time.perf_counter() - start, r.status_code,
+                          _parse_server_timing(r.headers.get("Server-Timing")))
+            except requests.RequestException:
+                sample = (time.perf_counter() - start, 0, {})
+            with samples_lock:
+                samples.append(sample)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+    return samples, time.perf_counter() - started
+
+
+def summarize(samples, elapsed):
+    """Latency percentiles (ms), throughput and a mean Server-Timing breakdown."""
+    latencies = np.array([s[0] for s in samples]) * 1000
+    ok = [s for s in samples if 200 <= s[1] < 400]
+    breakdown = {}
+    for _, _, spans in ok:
+        for name, ms in spans.items():
+            breakdown[name] = breakdown.get(name, 0.0) + ms
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if len(latencies) else (0, 0, 0)
+    return {
+        "requests": len(samples),
+        "errors": len(samples) - len(ok),
+        "throughput_rps": round(len(samples) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(float(p50), 2),
+        "p95_ms": round(float(p95), 2),
+        "p99_ms": round(float(p99), 2),
+        "mean_ms": round(float(latencies.mean()), 2) if len(latencies) else 0.0,
+        "max_ms": round(float(latencies.max()), 2) if len(latencies) else 0.0,
+        "server_timing_ms": {name: round(total / len(ok), 2) for name, total in sorted(breakdown.items())},
+    }
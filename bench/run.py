@@ -0,0 +1,187 @@
+"""Run the app against local Strava/OpenAI fakes and load-test its main routes.
+
+    python -m bench.run --label my-change
+    python -m bench.compare bench/results/baseline.json bench/results/my-change.json
+
+Everything runs in a scratch directory (its own cadence.db, tokens and caches),
+so results don't depend on local data and runs are repeatable.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime, timezone
+
+import requests
+
+from bench.load import drive, summarize
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO, "bench", "results")
+FIXTURES = ("profile.json", "plan.json")  # copied into the scratch directory
+
+CHAT_MESSAGES = ["How was my week?", "Should I rest tomorrow?", "Am I ready for a 10k race?"]
+
+# name -> (method, path builder, form data)
+ROUTES = {
+    "GET /activities": ("GET", lambda n: ["/activities", "/activities?page=2", "/activities?sport=Run"], None),
+    "GET /activities/<id>": ("GET", lambda n: [f"/activities/{i}" for i in range(1, min(n, 50) + 1)], None),
+    "GET /aura": ("GET", lambda n: ["/aura"], None),
+    "GET /coach": ("GET", lambda n: ["/coach"], None),
+    "POST /chat": ("POST", lambda n: ["/chat"], lambda i: {"message": CHAT_MESSAGES[i % len(CHAT_MESSAGES)]}),
+    "GET /schedule": ("GET", lambda n: ["/schedule"], None),
+    "GET /calendar.ics": ("GET", lambda n: ["/calendar.ics"], None),
+}
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_for(url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(url, timeout=2).status_code < 500:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def _git_rev():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _start(args, cwd, env, log):
+    return subprocess.Popen([sys.executable] + args, cwd=cwd, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def run(config):
+    workdir = tempfile.mkdtemp(prefix="cadence-bench-")
+    for name in FIXTURES:
+        if os.path.exists(os.path.join(REPO, name)):
+            shutil.copy(os.path.join(REPO, name), workdir)
+    with open(os.path.join(workdir, "tokens.json"), "w") as f:
+        json.dump({"access_token": "bench", "refresh_token": "bench", "expires_at": 2 ** 31}, f)
+
+    strava_port, openai_port, app_port = _free_port(), _free_port(), _free_port()
+    env = dict(os.environ,
+               PYTHONPATH=REPO,
+               STRAVA_API_BASE=f"http://127.0.0.1:{strava_port}/api/v3",
+               STRAVA_OAUTH_URL=f"http://127.0.0.1:{strava_port}/oauth/token",
+               OPENAI_BASE_URL=f"http://127.0.0.1:{openai_port}/v1",
+               OPENAI_API_KEY="bench")
+    for key in ("CADENCE_DB", "CADENCE_DATA_DIR", "STICKER_CACHE_DIR", "THUMBNAIL_CACHE_DIR", "PHOTO_CACHE_DIR"):
+        env.pop(key, None)  # keep everything inside the scratch directory
+
+    log = open(os.path.join(workdir, "bench.log"), "w")
+    procs = []
+    try:
+        procs.append(_start(["-m", "fakes.strava", "--port", str(strava_port), "--seed", str(config.activities),
+                             "--latency", str(config.strava_latency), "--jitter", str(config.strava_jitter),
+                             "--rate-limit", config.strava_rate_limit], REPO, env, log))
+        procs.append(_start(["-m", "fakes.openai", "--port", str(openai_port),
+                             "--latency", str(config.openai_latency),
+                             "--tokens-per-second", str(config.openai_tps), "--rpm", str(config.openai_rpm)],
+                            REPO, env, log))
+        _wait_for(f"http://127.0.0.1:{strava_port}/api/v3/athlete/activities?per_page=1")
+        _wait_for(f"http://127.0.0.1:{openai_port}/_fake/stats")
+
+        # Import the seeded history the way a real install would
+        subprocess.run([sys.executable, "-m", "flask", "--app", "app", "backfill"], cwd=workdir, env=env,
+                       stdout=log, stderr=subprocess.STDOUT, check=True)
+        procs.append(_start(["-m", "flask", "--app", "app", "run", "--port", str(app_port), "--with-threads"],
+                            workdir, env, log))
+        base_url = f"http://127.0.0.1:{app_port}"
+        _wait_for(f"{base_url}/metrics")
+
+        # Warm-up: one pass over every route, and wait for today's plan so
+        # /coach and /calendar.ics measure the steady state
+        deadline = time.time() + 60
+        while b"generating" in requests.get(f"{base_url}/coach", timeout=60).content and time.time() < deadline:
+            time.sleep(0.5)
+
+        routes = {}
+        for name in config.routes:
+            method, paths, data = ROUTES[name]
+            paths = paths(config.activities)
+            drive(base_url, method, paths, len(paths), 1, data)
+            samples, elapsed = drive(base_url, method, paths, config.requests, config.concurrency, data)
+            routes[name] = summarize(samples, elapsed)
+            print(_format_row(name, routes[name]), flush=True)
+    finally:
+        for proc in reversed(procs):
+            proc.terminate()
+        for proc in procs:
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        log.close()
+        if not config.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "meta": {
+            "label": config.label,
+            "git_rev": _git_rev(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": {k: v for k, v in vars(config).items() if k not in ("label", "output", "keep")},
+        },
+        "routes": routes,
+    }
+
+
+HEADER = f"{'route':<24}{'req':>6}{'err':>5}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+
+
+def _format_row(name, r):
+    return (f"{name:<24}{r['requests']:>6}{r['errors']:>5}{r['throughput_rps']:>9.1f}"
+            f"{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['p99_ms']:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--label", default=None, help="result name (default: git revision)")
+    parser.add_argument("--output", default=None, help="result file (default: bench/results/<label>.json)")
+    parser.add_argument("--requests", type=int, default=200, help="requests per route")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--activities", type=int, default=500, help="activities in the fake Strava account")
+    parser.add_argument("--routes", nargs="+", default=list(ROUTES), choices=list(ROUTES), metavar="ROUTE")
+    parser.add_argument("--strava-latency", type=float, default=0.15, help="seconds per Strava call")
+    parser.add_argument("--strava-jitter", type=float, default=0.05)
+    parser.add_argument("--strava-rate-limit", default="600,30000", help="15-minute,daily limits")
+    parser.add_argument("--openai-latency", type=float, default=0.5, help="seconds to first byte")
+    parser.add_argument("--openai-tps", type=float, default=80.0, help="streamed tokens per second")
+    parser.add_argument("--openai-rpm", type=int, default=0, help="requests per minute (0 = unlimited)")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch directory and its bench.log")
+    config = parser.parse_args()
+    config.label = config.label or _git_rev() or "unversioned"
+
+    print(HEADER)
+    result = run(config)
+    output = config.output or os.path.join(RESULTS_DIR, f"{config.label}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2, sort_keys=True)
+        f.write("\n")
+    print(f"\nSaved {output}")
+
+
+if __name__ == "__main__":
+    main()
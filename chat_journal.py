@@ -0,0 +1,180 @@
+import os
+import json
+import struct
+from datetime import date
+
+import store
+import tenancy
+from fileutil import file_lock
+
+JOURNAL_FILE = "chat_history.jsonl"
+INDEX_FILE = "chat_history.idx"  # one little-endian uint64 byte offset per message
+ARCHIVE_FILE = "chat_history.archive.jsonl"  # older messages rolled out of the journal
+LEGACY_FILE = "chat_history.json"
+COMPACT_EVERY = 500  # appends between compactions
+KEEP = 1000  # messages left in the journal by a compaction; the rest go to the archive
+
+OFFSET = struct.Struct("<Q")
+
+
+def _file(name):
+    return tenancy.path(name)
+
+
+def _index_count():
+    try:
+        return os.path.getsize(_file(INDEX_FILE)) // OFFSET.size
+    except FileNotFoundError:
+        return 0
+
+
+def _scan(start=0, name=JOURNAL_FILE):
+    """(offset, message) for every complete, valid line from `start` on."""
+    entries = []
+    with open(_file(name), "rb") as f:
+        f.seek(start)
+        offset = start
+        for line in f:
+            if line.endswith(b"\n"):
+                try:
+                    entries.append((offset, json.loads(line)))
+                except ValueError:
+                    pass  # corrupt line: skipped now, dropped at the next compaction
+            offset += len(line)
+    return entries
+
+
+def _write_index(offsets, mode="ab"):
+    with open(_file(INDEX_FILE), mode) as f:
+        f.write(b"".join(OFFSET.pack(o) for o in offsets))
+
+
+def _migrate_legacy():
+    """Start the journal from the old single-JSON history file, once."""
+    if os.path.exists(_file(JOURNAL_FILE)) or not os.path.exists(_file(LEGACY_FILE)):
+        return
+    with open(_file(LEGACY_FILE), "r") as f:
+        history = json.load(f)
+    _append_locked(history)
+
+
+def _append_locked(messages):
+    lines = [json.dumps(m, ensure_ascii=False).encode("utf-8") + b"\n" for m in messages]
+    fd = os.open(_file(JOURNAL_FILE), os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        start = os.lseek(fd, 0, os.SEEK_END)
+        prefix = b""
+        if start and os.pread(fd, 1, start - 1) != b"\n":
+            # Terminate a torn line left by a crashed writer so it can't swallow ours
+            prefix = b"\n"
+            start += 1
+        # One write call per batch, so a reader never sees half of a user/assistant pair
+        os.write(fd, prefix + b"".join(lines))
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+    offsets, offset = [], start
+    for line in lines:
+        offsets.append(offset)
+        offset += len(line)
+    _write_index(offsets)
+
+
+def append(messages):
+    """Atomically append messages; cost is independent of the history length."""
+    with file_lock(_file(JOURNAL_FILE)):
+        _migrate_legacy()
+        _append_locked(messages)
+        store.index_chat_messages(messages, str(date.today()))
+        count = _index_count()
+        if count and count // COMPACT_EVERY != (count - len(messages)) // COMPACT_EVERY:
+            _compact_locked()
+
+
+def _read_offsets(first, count):
+    with open(_file(INDEX_FILE), "rb") as f:
+        f.seek(first * OFFSET.size)
+        data = f.read(count * OFFSET.size)
+    return [OFFSET.unpack_from(data, i * OFFSET.size)[0] for i in range(len(data) // OFFSET.size)]
+
+
+def _ensure_migrated():
+    if not os.path.exists(_file(JOURNAL_FILE)) and os.path.exists(_file(LEGACY_FILE)):
+        with file_lock(_file(JOURNAL_FILE)):
+            _migrate_legacy()
+
+
+def _tail_entries(n):
+    count = _index_count()
+    offsets = _read_offsets(max(count - n, 0), n) if count else []
+    return offsets, _scan(offsets[0] if offsets else 0)
+
+
+def tail(n=10):
+    """Last `n` messages (up to KEEP), read from the end of the journal via the offset index."""
+    _ensure_migrated()
+    if n <= 0 or not os.path.exists(_file(JOURNAL_FILE)):
+        return []
+
+    offsets, entries = _tail_entries(n)
+    if len(entries) != len(offsets):
+        # More lines than indexed offsets: a writer is between its journal and
+        # index writes, or one died there. Wait for writers, then repair if needed.
+        with file_lock(_file(JOURNAL_FILE)):
+            offsets, entries = _tail_entries(n)
+            if len(entries) != len(offsets):
+                _compact_locked()
+                offsets, entries = _tail_entries(n)
+
+    return [message for _, message in entries[-n:]]
+
+
+def read_all():
+    """Every message, archived ones included, oldest first."""
+    _ensure_migrated()
+    messages = []
+    for name in (ARCHIVE_FILE, JOURNAL_FILE):
+        if os.path.exists(_file(name)):
+            messages += [message for _, message in _scan(name=name)]
+    return messages
+
+
+def _compact_locked():
+    """Roll all but the last KEEP messages into the archive, then rewrite the
+    journal (dropping torn/corrupt lines) and rebuild the index.
+
+    The journal stays at most KEEP + COMPACT_EVERY messages, so a compaction
+    costs the same however long the history gets. A crash after the archive
+    write but before the journal replace leaves those messages in both files.
+    """
+    if not os.path.exists(_file(JOURNAL_FILE)):
+        return
+    messages = [message for _, message in _scan()]
+    if len(messages) > KEEP:
+        rolled, messages = messages[:-KEEP], messages[-KEEP:]
+        with open(_file(ARCHIVE_FILE), "ab") as f:
+            f.write(b"".join(json.dumps(m, ensure_ascii=False).encode("utf-8") + b"\n" for m in rolled))
+            f.flush()
+            os.fsync(f.fileno())
+    tmp_journal, tmp_index = _file(JOURNAL_FILE) + ".tmp", _file(INDEX_FILE) + ".tmp"
+
+    offsets, offset = [], 0
+    with open(tmp_journal, "wb") as f:
+        for message in messages:
+            line = json.dumps(message, ensure_ascii=False).encode("utf-8") + b"\n"
+            offsets.append(offset)
+            offset += len(line)
+            f.write(line)
+        f.flush()
+        os.fsync(f.fileno())
+    with open(tmp_index, "wb") as f:
+        f.write(b"".join(OFFSET.pack(o) for o in offsets))
+
+    os.replace(tmp_journal, _file(JOURNAL_FILE))
+    os.replace(tmp_index, _file(INDEX_FILE))
+
+
+def compact():
+    with file_lock(_file(JOURNAL_FILE)):
+        _compact_locked()
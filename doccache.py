@@ -0,0 +1,54 @@
+import os
+import json
+import threading
+
+import metrics
+from fileutil import atomic_write_json
+
+
+class DocumentCache:
+    """Parsed JSON documents kept in memory and revalidated with a single stat().
+
+    A document is re-parsed only when its (inode, mtime, size) changes, which
+    also catches writes made by other worker processes (atomic renames give
+    the file a new inode). Returned objects are shared: treat them as
+    read-only and deep-copy before mutating.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def load(self, path, default=None):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            with self.lock:
+                self.entries.pop(path, None)
+            return default
+        signature = (st.st_ino, st.st_mtime_ns, st.st_size)
+
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry and entry[0] == signature:
+                metrics.cache_event("documents", True)
+                return entry[1]
+        metrics.cache_event("documents", False)
+
+        with open(path, "r") as f:
+            data = json.load(f)
+        with self.lock:
+            self.entries[path] = (signature, data)
+        return data
+
+    def save(self, path, data):
+        """Write-through: atomically replace the file and refresh the cached copy."""
+        atomic_write_json(path, data)
+        st = os.stat(path)
+        with self.lock:
+            self.entries[path] = ((st.st_ino, st.st_mtime_ns, st.st_size), data)
+
+
+docs = DocumentCache()
+load = docs.load
+save = docs.save
@@ -0,0 +1 @@
+"""Local stand-ins for external services, for development and end-to-end checks."""
@@ -0,0 +1,106 @@
+"""A stand-in for OpenAI's chat completions endpoint with tunable latency.
+
+    python -m fakes.openai --port 8766 --latency 0.4 --tokens-per-second 60
+    OPENAI_BASE_URL=http://127.0.0.1:8766/v1 flask run
+
+Replies are canned: JSON plans when `response_format` asks for JSON, a short
+coaching paragraph otherwise. Streaming requests get Server-Sent Events.
+"""
+import json
+import time
+import random
+import argparse
+import threading
+
+from flask import Flask, Response, jsonify, request
+
+PLAN = {"sport": "Run", "duration_min": 45, "intensity": "easy",
+        "rationale": "Aerobic volume after yesterday's hard session keeps the week balanced."}
+REPLY = ("Nice consistency this week. Keep tomorrow easy, fuel well after long sessions "
+         "and save the intensity for Thursday's intervals.")
+
+settings = {
+    "latency": 0.0,             # seconds before the first byte
+    "jitter": 0.0,
+    "tokens_per_second": 0.0,   # 0 streams as fast as possible
+    "rpm": 0,                   # requests per minute before 429s (0 = unlimited)
+}
+
+app = Flask(__name__)
+
+_lock = threading.Lock()
+_window = {"minute": 0, "count": 0}
+stats = {"requests": 0, "streamed": 0, "rate_limited": 0}
+
+
+def _rate_limited():
+    if not settings["rpm"]:
+        return False
+    with _lock:
+        minute = int(time.time()) // 60
+        if minute != _window["minute"]:
+            _window.update(minute=minute, count=0)
+        _window["count"] += 1
+        return _window["count"] > settings["rpm"]
+
+
+def _chunk(content, finish_reason=None):
+    return {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()),
+            "model": "fake", "choices": [{"index": 0, "delta": {"content": content} if content else {},
+                                          "finish_reason": finish_reason}]}
+
+
+@app.route("/v1/chat/completions", methods=["POST"])
+def chat_completions():
+    body = request.get_json(force=True)
+    stats["requests"] += 1
+    if _rate_limited():
+        stats["rate_limited"] += 1
+        return jsonify({"error": {"message": "Rate limit reached", "type": "requests"}}), 429
+
+    time.sleep(max(settings["latency"] + random.uniform(-settings["jitter"], settings["jitter"]), 0))
+    content = json.dumps(PLAN) if body.get("response_format") else REPLY
+
+    if not body.get("stream"):
+        words = len(content.split())
+        if settings["tokens_per_second"]:
+            time.sleep(words / settings["tokens_per_second"])
+        return jsonify({
+            "id": "chatcmpl-fake", "object": "chat.completion", "created": int(time.time()), "model": "fake",
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": words, "total_tokens": words},
+        })
+
+    stats["streamed"] += 1
+
+    def generate():
+        for word in content.split(" "):
+            if settings["tokens_per_second"]:
+                time.sleep(1 / settings["tokens_per_second"])
+            yield f"data: {json.dumps(_chunk(word + ' '))}\n\n"
+        yield f"data: {json.dumps(_chunk(None, 'stop'))}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return Response(generate(), mimetype="text/event-stream")
+
+
+@app.route("/_fake/stats")
+def fake_stats():
+    return jsonify(stats)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before the first byte")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--tokens-per-second", type=float, default=0.0)
+    parser.add_argument("--rpm", type=int, default=0, help="requests per minute before 429s (0 = no limit)")
+    args = parser.parse_args()
+    settings.update(latency=args.latency, jitter=args.jitter,
+                    tokens_per_second=args.tokens_per_second, rpm=args.rpm)
+    app.run(port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
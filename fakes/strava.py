@@ -0,0 +1,268 @@
+"""A small in-memory Strava API with push-subscription support.
+
+Run it next to the app and point the app at it:
+
+    python -m fakes.strava --port 8765
+    STRAVA_API_BASE=http://127.0.0.1:8765/api/v3 \\
+    STRAVA_OAUTH_URL=http://127.0.0.1:8765/oauth/token flask run
+
+Subscribe the app's webhook (the fake performs the hub.challenge handshake,
+and the app records the subscription id it must see on every event):
+
+    STRAVA_API_BASE=http://127.0.0.1:8765/api/v3 \\
+    flask subscribe-webhook http://127.0.0.1:5000/webhooks/strava
+
+Then change data through the /_fake endpoints; each change is pushed to the
+subscribed callback exactly like Strava would:
+
+    curl -X POST http://127.0.0.1:8765/_fake/activities -H 'Content-Type: application/json' \\
+        -d '{"name": "Lunch Run", "type": "Run", "distance": 5000, "moving_time": 1500}'
+    curl -X DELETE http://127.0.0.1:8765/_fake/activities/1
+"""
+import io
+import math
+import time
+import random
+import secrets
+import argparse
+import threading
+from datetime import datetime, timezone
+
+import requests
+from flask import Flask, jsonify, request, send_file
+from PIL import Image
+
+ATHLETE_ID = 1
+PHOTO_EVERY = 4  # every Nth seeded activity has a photo, served from /_fake/photos
+
+# Behaviour knobs (set from the command line or by the bench runner)
+settings = {
+    "latency": 0.0,       # seconds added to every API response
+    "jitter": 0.0,        # +/- uniform random seconds on top of latency
+    "short_limit": 600,   # requests per 15-minute window before 429s
+    "daily_limit": 30000,
+    "base_url": "http://127.0.0.1:8765",  # where photo URLs point (the CDN stand-in)
+}
+
+app = Flask(__name__)
+
+_lock = threading.Lock()
+_activities = {}  # id -> activity detail
+_subscription = {}
+_usage = {"short": 0, "daily": 0, "window": 0}
+_next_id = [1]
+
+
+def _iso(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _photo_urls(activity_id, sizes):
+    return {str(size): f"{settings['base_url']}/_fake/photos/{activity_id}-{size}.jpg" for size in sizes}
+
+
+def make_activity(activity_id, **fields):
+    """A plausible activity detail; `fields` override the defaults."""
+    start = fields.pop("start_ts", None) or int(time.time()) - 3600
+    distance = float(fields.get("distance", 5000))
+    moving_time = int(fields.get("moving_time", 1500))
+    km = max(int(distance // 1000), 1)
+    activity = {
+        "id": activity_id,
+        "name": f"Activity {activity_id}",
+        "type": "Run",
+        "sport_type": "Run",
+        "start_date": _iso(start),
+        "start_date_local": _iso(start),
+        "distance": distance,
+        "moving_time": moving_time,
+        "elapsed_time": moving_time,
+        "average_heartrate": 145.0,
+        "map": {"summary_polyline": "_p~iF~ps|U_ulLnnqC_mqNvxq`@"},
+        "photos": ({"count": 1, "primary": {"unique_id": f"photo-{activity_id}",
+                                            "urls": _photo_urls(activity_id, (100, 600))}}
+                   if activity_id % PHOTO_EVERY == 0 else {"count": 0}),
+        "splits_metric": [
+            {"split": i + 1, "distance": distance / km, "moving_time": moving_time / km,
+             "elapsed_time": moving_time / km, "average_speed": distance / moving_time,
+             "average_heartrate": 145.0, "elevation_difference": 0, "pace_zone": 2}
+            for i in range(km)
+        ],
+    }
+    activity.update(fields)
+    return activity
+
+
+@app.after_request
+def _rate_limit_headers(response):
+    response.headers["X-RateLimit-Limit"] = f"{settings['short_limit']},{settings['daily_limit']}"
+    response.headers["X-RateLimit-Usage"] = f"{_usage['short']},{_usage['daily']}"
+    return response
+
+
+@app.before_request
+def _count_usage():
+    if request.path.startswith("/api/v3/"):
+        with _lock:
+            window = int(time.time()) // 900  # Strava's 15-minute windows are wall-clock aligned
+            if window != _usage["window"]:
+                _usage.update(short=0, window=window)
+            _usage["short"] += 1
+            _usage["daily"] += 1
+        delay = settings["latency"] + random.uniform(-settings["jitter"], settings["jitter"])
+        if delay > 0:
+            time.sleep(delay)
+        if _usage["short"] > settings["short_limit"] or _usage["daily"] > settings["daily_limit"]:
+            return jsonify({"message": "Rate Limit Exceeded"}), 429
+
+
+# --- Strava API ---
+
+@app.route("/oauth/token", methods=["POST"])
+def oauth_token():
+    return jsonify({
+        "token_type": "Bearer",
+        "access_token": secrets.token_hex(16),
+        "refresh_token": secrets.token_hex(16),
+        "expires_at": int(time.time()) + 6 * 3600,
+        "athlete": {"id": ATHLETE_ID},
+    })
+
+
+@app.route("/api/v3/athlete/activities")
+def athlete_activities():
+    after = int(request.args.get("after", 0))
+    before = int(request.args.get("before", 2 ** 62))
+    page = int(request.args.get("page", 1))
+    per_page = int(request.args.get("per_page", 30))
+    with _lock:
+        # Strava lists newest first, or oldest first when paging forward with `after`
+        acts = sorted(_activities.values(), key=lambda a: a["start_date"], reverse="after" not in request.args)
+    acts = [a for a in acts
+            if after < datetime.fromisoformat(a["start_date"].replace("Z", "+00:00")).timestamp() < before]
+    summaries = [{k: v for k, v in a.items() if k != "splits_metric"} for a in acts]
+    return jsonify(summaries[(page - 1) * per_page:page * per_page])
+
+
+@app.route("/api/v3/activities/<int:activity_id>")
+def activity(activity_id):
+    act = _activities.get(activity_id)
+    if act is None:
+        return jsonify({"message": "Record Not Found"}), 404
+    return jsonify(act)
+
+
+@app.route("/api/v3/activities/<int:activity_id>/photos")
+def activity_photos(activity_id):
+    act = _activities.get(activity_id)
+    if act is None:
+        return jsonify({"message": "Record Not Found"}), 404
+    if not act["photos"]["count"]:
+        return jsonify([])
+    size = request.args.get("size", type=int) or 100
+    return jsonify([{"unique_id": f"photo-{activity_id}", "urls": _photo_urls(activity_id, (size,))}])
+
+
+@app.route("/api/v3/activities/<int:activity_id>/streams")
+def activity_streams(activity_id):
+    act = _activities.get(activity_id)
+    if act is None:
+        return jsonify({"message": "Record Not Found"}), 404
+    n = act["elapsed_time"]  # one sample per second
+    channels = {
+        "time": list(range(n)),
+        "distance": [act["distance"] * i / n for i in range(n)],
+        "altitude": [50 + 10 * math.sin(i / 600) for i in range(n)],
+        "heartrate": [int(act.get("average_heartrate", 140) + 15 * math.sin(i / 300)) for i in range(n)],
+        "velocity_smooth": [act["distance"] / n for _ in range(n)],
+    }
+    keys = request.args.get("keys", "").split(",")
+    return jsonify({k: {"type": k, "data": v, "original_size": n, "resolution": "high"}
+                    for k, v in channels.items() if k in keys or k == "time"})
+
+
+@app.route("/api/v3/push_subscriptions", methods=["GET", "POST"])
+def push_subscriptions():
+    if request.method == "GET":
+        return jsonify([_subscription] if _subscription else [])
+    callback_url = request.values["callback_url"]
+    challenge = secrets.token_hex(8)
+    r = requests.get(callback_url, params={
+        "hub.mode": "subscribe", "hub.challenge": challenge,
+        "hub.verify_token": request.values.get("verify_token", ""),
+    }, timeout=2)
+    if not r.ok or r.json().get("hub.challenge") != challenge:
+        return jsonify({"message": "Callback verification failed"}), 400
+    _subscription.update({"id": 1, "callback_url": callback_url})
+    return jsonify({"id": 1}), 201
+
+
+@app.route("/_fake/photos/<int:activity_id>-<int:size>.jpg")
+def photo(activity_id, size):
+    """A 4:3 JPEG of the requested width, standing in for Strava's photo CDN."""
+    delay = settings["latency"] + random.uniform(-settings["jitter"], settings["jitter"])
+    if delay > 0:
+        time.sleep(delay)
+    size = min(size, 2048)
+    img = Image.linear_gradient("L").resize((size, size * 3 // 4)).convert("RGB")
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=90)
+    buf.seek(0)
+    return send_file(buf, mimetype="image/jpeg")
+
+
+# --- Test controls ---
+
+def push_event(object_id, aspect_type, updates=None):
+    """Deliver an event to the subscribed callback (as Strava does, after the change)."""
+    if not _subscription:
+        return None
+    event = {
+        "object_type": "activity", "object_id": object_id, "aspect_type": aspect_type,
+        "updates": updates or {}, "owner_id": ATHLETE_ID, "subscription_id": _subscription["id"],
+        "event_time": int(time.time()),
+    }
+    return requests.post(_subscription["callback_url"], json=event, timeout=2).status_code
+
+
+@app.route("/_fake/activities", methods=["POST"])
+def fake_create():
+    fields = request.get_json(silent=True) or {}
+    with _lock:
+        activity_id = fields.pop("id", None) or _next_id[0]
+        _next_id[0] = max(_next_id[0], activity_id + 1)
+        exists = activity_id in _activities
+        if exists:
+            _activities[activity_id].update(fields)
+        else:
+            _activities[activity_id] = make_activity(activity_id, **fields)
+    status = push_event(activity_id, "update" if exists else "create", fields if exists else None)
+    return jsonify({"id": activity_id, "delivered": status}), 200 if exists else 201
+
+
+@app.route("/_fake/activities/<int:activity_id>", methods=["DELETE"])
+def fake_delete(activity_id):
+    with _lock:
+        _activities.pop(activity_id, None)
+    return jsonify({"id": activity_id, "delivered": push_event(activity_id, "delete")})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--seed", type=int, default=0, help="number of activities to start with")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to each API call")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--rate-limit", default="600,30000", help="15-minute and daily request limits")
+    args = parser.parse_args()
+    settings["latency"], settings["jitter"] = args.latency, args.jitter
+    settings["short_limit"], settings["daily_limit"] = (int(v) for v in args.rate_limit.split(","))
+    settings["base_url"] = f"http://127.0.0.1:{args.port}"
+    for i in range(args.seed):
+        _activities[i + 1] = make_activity(i + 1, start_ts=int(time.time()) - (args.seed - i) * 86400)
+    _next_id[0] = args.seed + 1
+    app.run(port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
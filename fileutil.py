@@ -0,0 +1,106 @@
+import os
+import json
+import tempfile
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to in-process locking only
+    fcntl = None
+
+
+def atomic_write_json(path, data, indent=2):
+    """Write JSON to a temp file next to `path`, fsync it, then rename over `path`.
+
+    Readers (in this or any other process) see either the old file or the new
+    one, never a half-written file.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".json")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, indent=indent)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def persistent_secret(path, size=32):
+    """Random key stored at `path`, generated on first use and shared by every process."""
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        pass
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")  # created 0600
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(os.urandom(size))
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            os.link(tmp_path, path)  # fails if another process got there first
+        except FileExistsError:
+            pass
+    finally:
+        os.unlink(tmp_path)
+    with open(path, "rb") as f:
+        return f.read()
+
+
+@contextmanager
+def file_lock(path):
+    """Exclusive advisory lock on `path` + ".lock", shared by all worker processes."""
+    if fcntl is None:
+        yield
+        return
+    with open(path + ".lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def evict_lru(directory, max_files, max_bytes, suffixes=None):
+    """Delete least recently used files (by mtime) until the directory fits the limits."""
+    entries = []
+    for name in os.listdir(directory):
+        if suffixes and not name.endswith(tuple(suffixes)):
+            continue
+        try:
+            st = os.stat(os.path.join(directory, name))
+        except FileNotFoundError:
+            continue
+        entries.append((st.st_mtime, st.st_size, name))
+    entries.sort()
+
+    total = sum(size for _, size, _ in entries)
+    while entries and (len(entries) > max_files or total > max_bytes):
+        _, size, name = entries.pop(0)
+        try:
+            os.unlink(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def remove_prefixed(directory, prefix):
+    """Delete every file in `directory` whose name starts with `prefix`."""
+    if not os.path.isdir(directory):
+        return 0
+    removed = 0
+    for name in os.listdir(directory):
+        if name.startswith(prefix):
+            try:
+                os.unlink(os.path.join(directory, name))
+                removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
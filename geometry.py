@@ -0,0 +1,105 @@
+import hashlib
+
+import numpy as np
+import polyline
+
+import metrics
+import store
+
+# Douglas–Peucker tolerances in degrees of latitude (~111 km per degree)
+LEVELS = {
+    "thumb": 0.0005,   # ~55 m: tiny previews
+    "card": 0.0001,    # ~11 m: grid cards
+    "detail": 0.00002, # ~2 m: full-width activity map
+}
+
+
+def decode(encoded):
+    """Encoded polyline → (n, 2) array of (lat, lng)."""
+    if not encoded:
+        return np.empty((0, 2))
+    return np.asarray(polyline.decode(encoded), dtype=np.float64)
+
+
+def _planar(points):
+    # Scale longitude by cos(latitude) so one tolerance means the same distance on both axes
+    return np.column_stack([points[:, 1] * np.cos(np.radians(points[:, 0].mean())), points[:, 0]])
+
+
+def simplify(points, tolerance):
+    """Douglas–Peucker, iterative, with each segment's distances computed in one NumPy pass."""
+    n = len(points)
+    if n < 3:
+        return points
+    xy = _planar(points)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+
+    stack = [(0, n - 1)]
+    while stack:
+        i, j = stack.pop()
+        if j <= i + 1:
+            continue
+        a, b = xy[i], xy[j]
+        seg = xy[i + 1:j]
+        dx, dy = b - a
+        norm = np.hypot(dx, dy)
+        if norm == 0:
+            dist = np.hypot(seg[:, 0] - a[0], seg[:, 1] - a[1])
+        else:
+            dist = np.abs(dx * (seg[:, 1] - a[1]) - dy * (seg[:, 0] - a[0])) / norm
+        k = int(np.argmax(dist))
+        if dist[k] > tolerance:
+            m = i + 1 + k
+            keep[m] = True
+            stack.append((i, m))
+            stack.append((m, j))
+    return points[keep]
+
+
+def encode(points):
+    return polyline.encode([tuple(p) for p in points.tolist()])
+
+
+def variants(encoded):
+    """Simplified re-encodings of a polyline for every level in LEVELS."""
+    points = decode(encoded)
+    return {level: encode(simplify(points, tol)) for level, tol in LEVELS.items()}
+
+
+def source_hash(encoded):
+    return hashlib.sha1(encoded.encode()).hexdigest()
+
+
+def route_variant(activity_id, encoded, level):
+    """Polyline for `level`, simplified once per activity and cached in the store."""
+    if not encoded:
+        return None
+    digest = source_hash(encoded)
+    cached = store.get_route_variant(activity_id, level, digest)
+    metrics.cache_event("route_variants", cached is not None)
+    if cached is not None:
+        return cached
+
+    computed = variants(encoded)
+    store.save_route_variants(activity_id, digest, computed)
+    return computed[level]
+
+
+def project_route(coords, box):
+    """Fit (lat, lng) pairs into a pixel box, keeping the route's aspect ratio."""
+    pts = np.asarray(coords, dtype=np.float64)
+    lat, lng = pts[:, 0], pts[:, 1]
+    # Equirectangular projection: shrink longitude by cos(latitude)
+    x = lng * np.cos(np.radians(lat.mean()))
+    y = -lat
+
+    left, top, right, bottom = box
+    span_x = max(x.max() - x.min(), 1e-9)
+    span_y = max(y.max() - y.min(), 1e-9)
+    scale = min((right - left) / span_x, (bottom - top) / span_y)
+
+    # Center the scaled route inside the box
+    px = (x - x.min()) * scale + left + ((right - left) - span_x * scale) / 2
+    py = (y - y.min()) * scale + top + ((bottom - top) - span_y * scale) / 2
+    return np.column_stack([px, py]).round().astype(np.int32)
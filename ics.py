@@ -0,0 +1,69 @@
+from datetime import datetime, timezone
+
+import plan_store
+
+PRODID = "-//Cadence//Training Plans//EN"
+DEFAULT_START = "T070000"  # plans have no time of day; default 7 AM (floating local time)
+
+
+def escape_text(value):
+    """Escape a TEXT value (RFC 5545 §3.3.11)."""
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace(";", "\\;")
+        .replace(",", "\\,")
+        .replace("\r\n", "\\n")
+        .replace("\n", "\\n")
+    )
+
+
+def fold(line):
+    """Fold a content line into 75-octet chunks without splitting UTF-8 characters (§3.1)."""
+    data = line.encode("utf-8")
+    if len(data) <= 75:
+        return line + "\r\n"
+
+    chunks, start, limit = [], 0, 75
+    while start < len(data):
+        end = min(start + limit, len(data))
+        # Back up to a character boundary (continuation bytes look like 0b10xxxxxx)
+        while end < len(data) and (data[end] & 0xC0) == 0x80:
+            end -= 1
+        chunks.append(data[start:end].decode("utf-8"))
+        start = end
+        limit = 74  # continuation lines start with a space
+    return "\r\n ".join(chunks) + "\r\n"
+
+
+def _utc(ts):
+    return datetime.fromtimestamp(ts or 0, tz=timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+
+def event(day, plan, updated_at):
+    """One VEVENT; the UID depends only on the date, so updates replace the old event."""
+    lines = [
+        "BEGIN:VEVENT",
+        f"UID:plan-{day}@cadence",
+        f"DTSTAMP:{_utc(updated_at)}",
+        f"DTSTART:{day.replace('-', '')}{DEFAULT_START}",
+        f"DURATION:PT{int(plan_store.duration_minutes(plan) or 60)}M",
+        f"SUMMARY:{escape_text(plan.get('sport', 'Training'))} — {escape_text(plan.get('intensity', ''))}",
+        f"DESCRIPTION:{escape_text(plan.get('rationale', ''))}",
+        "END:VEVENT",
+    ]
+    return "".join(fold(line) for line in lines)
+
+
+def generate(rows):
+    """Yield the calendar piece by piece from (date, plan, updated_at) rows."""
+    yield "".join(fold(line) for line in [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        f"PRODID:{PRODID}",
+        "CALSCALE:GREGORIAN",
+        "X-WR-CALNAME:Cadence Training",
+    ])
+    for day, plan, updated_at in rows:
+        yield event(day, plan, updated_at)
+    yield fold("END:VCALENDAR")
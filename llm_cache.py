@@ -0,0 +1,65 @@
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+import metrics
+
+MAX_ENTRIES = 1000
+MAX_BYTES = 8 * 1024 * 1024
+
+
+def fingerprint(model, messages, **params):
+    """Content address of a completion request: model + messages + parameters."""
+    payload = json.dumps({"model": model, "messages": messages, "params": params},
+                         sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class CompletionCache:
+    """LRU of completion texts, bounded by entry count and total size."""
+
+    def __init__(self, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            content = self.entries.get(key)
+            if content is not None:
+                self.entries.move_to_end(key)
+            return content
+
+    def put(self, key, content):
+        cost = len(content.encode("utf-8"))
+        if cost > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.size -= len(self.entries.pop(key).encode("utf-8"))
+            self.entries[key] = content
+            self.size += cost
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted.encode("utf-8"))
+
+
+cache = CompletionCache()
+
+
+def complete(client, model, messages, **params):
+    """Return the completion text, calling the API only for unseen fingerprints."""
+    key = fingerprint(model, messages, **params)
+    content = cache.get(key)
+    metrics.cache_event("llm", content is not None)
+    if content is not None:
+        return content
+
+    with metrics.span("openai"):
+        completion = client.chat.completions.create(model=model, messages=messages, **params)
+    content = completion.choices[0].message.content
+    cache.put(key, content)
+    return content
@@ -0,0 +1,138 @@
+import time
+import threading
+import contextvars
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Prometheus' default latency buckets (seconds)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Spans recorded while handling the current request, for the Server-Timing header
+_request_spans = contextvars.ContextVar("request_spans", default=None)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = buckets
+        self.series = {}  # labels -> [bucket counts..., sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        i = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [0] * (len(self.buckets) + 2)
+            if i < len(self.buckets):
+                series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            snapshot = {key: list(series) for key, series in self.series.items()}
+        for key, series in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', bound),))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(key + (('le', '+Inf'),))} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {series[-2]:.6f}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {series[-1]}")
+        return lines
+
+
+request_seconds = Histogram("cadence_request_duration_seconds", "Time to produce a response, by route.")
+span_seconds = Histogram("cadence_span_duration_seconds",
+                         "Time spent in upstream calls and rendering (strava, openai, sticker_render, ...).")
+cache_requests = Counter("cadence_cache_requests_total", "Cache lookups by cache and result (hit/miss).")
+upstream_errors = Counter("cadence_span_errors_total", "Spans that ended with an exception.")
+
+REGISTRY = [request_seconds, span_seconds, cache_requests, upstream_errors]
+
+
+@contextmanager
+def span(name):
+    """Time a block: feeds the span histogram and the current request's Server-Timing."""
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        upstream_errors.inc(span=name)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        span_seconds.observe(elapsed, span=name)
+        spans = _request_spans.get()
+        if spans is not None:
+            spans.append((name, elapsed))
+
+
+def cache_event(cache, hit):
+    cache_requests.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def begin_request():
+    """Start collecting spans for the request running in this context; returns the list."""
+    spans = []
+    _request_spans.set(spans)
+    return spans
+
+
+def propagate(fn):
+    """Wrap `fn` to run in a copy of the current context (spans from pool threads count too)."""
+    ctx = contextvars.copy_context()
+    return lambda *args, **kwargs: ctx.run(fn, *args, **kwargs)
+
+
+def server_timing(spans, total):
+    """Server-Timing header value: spans summed per name, plus the total."""
+    totals, counts = {}, {}
+    for name, elapsed in spans:
+        totals[name] = totals.get(name, 0.0) + elapsed
+        counts[name] = counts.get(name, 0) + 1
+    parts = [f'{name};dur={seconds * 1000:.1f};desc="{counts[name]}x"' for name, seconds in totals.items()]
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,100 @@
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+
+try:
+    import brotli
+except ImportError:  # optional: without it pages are offered gzip-compressed only
+    brotli = None
+
+MAX_BYTES = 32 * 1024 * 1024  # rendered bodies (all encodings) kept per process
+MIN_COMPRESS = 512  # smaller bodies aren't worth a Content-Encoding
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# Each encoding is a different byte sequence, so it gets its own strong ETag
+ETAG_SUFFIXES = {"identity": "", "gzip": "-gz", "br": "-br"}
+
+COMPRESSORS = {"gzip": lambda body: gzip.compress(body, GZIP_LEVEL, mtime=0)}
+if brotli is not None:
+    COMPRESSORS["br"] = lambda body: brotli.compress(body, quality=BROTLI_QUALITY)
+
+
+class PageCache:
+    """Rendered pages keyed by (athlete, URL, data version), least recently used evicted first.
+
+    Entries are never invalidated explicitly: a write bumps the data version,
+    the next request builds a new key and the stale entry ages out. Compressed
+    bodies are made on first request for each encoding and kept alongside.
+    """
+
+    def __init__(self, max_bytes=MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key, html):
+        body = html.encode("utf-8")
+        entry = {"key": key, "etag": hashlib.sha256(body).hexdigest()[:32], "bodies": {"identity": body}}
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= _entry_size(old)
+            self.entries[key] = entry
+            self.size += len(body)
+            self._evict()
+        return entry
+
+    def body(self, entry, encoding):
+        """The entry's body in `encoding`, compressing (once) on first use."""
+        data = entry["bodies"].get(encoding)
+        if data is None:
+            data = COMPRESSORS[encoding](entry["bodies"]["identity"])
+            with self.lock:
+                if encoding not in entry["bodies"]:
+                    entry["bodies"][encoding] = data
+                    if self.entries.get(entry["key"]) is entry:  # still cached: account for it
+                        self.size += len(data)
+                        self._evict()
+        return data
+
+    def _evict(self):
+        while self.size > self.max_bytes and len(self.entries) > 1:
+            _, entry = self.entries.popitem(last=False)
+            self.size -= _entry_size(entry)
+
+
+def _entry_size(entry):
+    return sum(len(body) for body in entry["bodies"].values())
+
+
+def etag(entry, encoding):
+    """Strong ETag of the entry's body in `encoding`."""
+    return entry["etag"] + ETAG_SUFFIXES[encoding]
+
+
+def etags(entry):
+    """ETags of every encoding of the entry (all validate the same page)."""
+    return [etag(entry, encoding) for encoding in ("identity", *COMPRESSORS)]
+
+
+def negotiate(accept_encodings, size):
+    """Best encoding the client accepts for a body of `size` bytes."""
+    if size < MIN_COMPRESS:
+        return "identity"
+    for encoding in ("br", "gzip"):
+        if encoding in COMPRESSORS and accept_encodings[encoding]:
+            return encoding
+    return "identity"
+
+
+cache = PageCache()
@@ -0,0 +1,107 @@
+import os
+import hashlib
+import threading
+from io import BytesIO
+
+import requests
+from PIL import Image, ImageOps
+
+import metrics
+import strava_client
+from fileutil import evict_lru
+
+CACHE_DIR = os.getenv("PHOTO_CACHE_DIR", os.path.join("cache", "photos"))
+STYLE_VERSION = 1  # bump when sizes/encoding change so clients and the cache refresh
+
+# name -> longest edge in pixels (photos are never upscaled)
+VARIANTS = {
+    "thumb": 200,
+    "card": 640,
+    "full": 1600,
+}
+QUALITY = 82
+FETCH_TIMEOUT = 10
+MAX_SOURCE_BYTES = 20 * 1024 * 1024
+MAX_FILES = 20000
+MAX_BYTES = int(os.getenv("PHOTO_CACHE_BYTES", 500 * 1024 * 1024))
+
+
+class PhotoError(Exception):
+    """The source photo could not be downloaded or decoded."""
+
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def source_url(urls):
+    """Largest rendition in a Strava photo `urls` dict ({"100": ..., "600": ...})."""
+    if not urls:
+        return None
+    return urls[max(urls, key=lambda size: int(size) if str(size).isdigit() else 0)]
+
+
+def etag(url, variant):
+    """Validator for a variant; Strava never reuses a photo URL for different content."""
+    return f"{hashlib.sha256(url.encode()).hexdigest()[:32]}-{variant}-v{STYLE_VERSION}"
+
+
+def _path(url, variant):
+    return os.path.join(CACHE_DIR, f"{etag(url, variant)}.jpg")
+
+
+def _download(url):
+    try:
+        with metrics.span("photo_fetch"), \
+                strava_client.session.get(url, timeout=FETCH_TIMEOUT, stream=True) as r:
+            r.raise_for_status()
+            data = bytearray()
+            for chunk in r.iter_content(64 * 1024):
+                data += chunk
+                if len(data) > MAX_SOURCE_BYTES:
+                    raise PhotoError(f"photo larger than {MAX_SOURCE_BYTES} bytes")
+    except requests.RequestException as e:
+        raise PhotoError(str(e)) from e
+    return bytes(data)
+
+
+def render(data, url):
+    """Write every variant of a downloaded photo, so the source is fetched only once."""
+    try:
+        img = ImageOps.exif_transpose(Image.open(BytesIO(data))).convert("RGB")
+    except (OSError, Image.DecompressionBombError) as e:
+        raise PhotoError(f"unreadable photo: {e}") from e
+
+    # Largest first, each variant downscaled from the previous one
+    for variant, px in sorted(VARIANTS.items(), key=lambda v: -v[1]):
+        img.thumbnail((px, px), Image.LANCZOS)
+        path = _path(url, variant)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        img.save(tmp_path, "JPEG", quality=QUALITY, optimize=True, progressive=True)
+        os.replace(tmp_path, path)
+
+
+def _lock_for(url):
+    with _locks_guard:
+        return _locks.setdefault(url, threading.Lock())
+
+
+def get_photo(url, variant="card"):
+    """Path of the cached variant, downloading and resizing the photo on first request."""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = _path(url, variant)
+    if os.path.exists(path):
+        os.utime(path)  # mark as recently used for eviction
+        metrics.cache_event("photos", True)
+        return path
+    metrics.cache_event("photos", False)
+
+    with _lock_for(url):
+        if not os.path.exists(path):
+            data = _download(url)
+            with metrics.span("photo_render"):
+                render(data, url)
+            evict_lru(CACHE_DIR, MAX_FILES, MAX_BYTES, suffixes=(".jpg",))
+    with _locks_guard:
+        _locks.pop(url, None)
+    return path
@@ -0,0 +1,128 @@
+import os
+import re
+import json
+import time
+import threading
+
+import store
+import tenancy
+
+LEGACY_FILE = "plan.json"
+
+_migrated = set()  # athletes (None = legacy mode) whose plan.json was checked this process
+_migrate_lock = threading.Lock()
+
+
+def _migrate_legacy(conn):
+    """Import plan.json into the plans table the first time the store is used."""
+    legacy_file = tenancy.path(LEGACY_FILE)
+    if store.get_state("plans_migrated") or not os.path.exists(legacy_file):
+        return
+    with open(legacy_file, "r") as f:
+        plans = json.load(f)
+    _write(conn, plans.items())
+    store.set_state("plans_migrated", True)
+
+
+def _ready():
+    """Store connection, with the legacy file imported once per process."""
+    conn = store.get_db()
+    athlete_id = tenancy.current()
+    if athlete_id not in _migrated:
+        with _migrate_lock:
+            if athlete_id not in _migrated:
+                _migrate_legacy(conn)
+                _migrated.add(athlete_id)
+    return conn
+
+
+def _bump_version(conn):
+    # Version counter for cache validators (ETags) on plan-derived views, and
+    # when it last moved (Last-Modified; deletes leave no updated_at behind)
+    conn.execute(
+        "INSERT INTO sync_state (key, value) VALUES ('plans_version', '1') "
+        "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1")
+    conn.execute(
+        "INSERT INTO sync_state (key, value) VALUES ('plans_modified', ?) "
+        "ON CONFLICT(key) DO UPDATE SET value = excluded.value", (str(int(time.time())),))
+
+
+def _write(conn, items):
+    now = int(time.time())
+    rows = [
+        (str(day), plan.get("sport"), plan.get("duration_min"), plan.get("intensity"), json.dumps(plan), now)
+        for day, plan in items
+    ]
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO plans (date, sport, duration_min, intensity, plan, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)", rows)
+        _bump_version(conn)
+
+
+def save_plan(day, plan):
+    _write(_ready(), [(day, plan)])
+
+
+def delete_plan(day):
+    conn = _ready()
+    with conn:
+        conn.execute("DELETE FROM plans WHERE date = ?", (str(day),))
+        _bump_version(conn)
+
+
+def duration_minutes(plan, default=60):
+    """A plan's duration_min as a number; the LLM sometimes answers "45-60" or "about 45"."""
+    value = plan.get("duration_min")
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    match = re.search(r"\d+(?:\.\d+)?", str(value or ""))
+    return float(match.group()) if match else default
+
+
+def get_plan(day):
+    row = _ready().execute("SELECT plan FROM plans WHERE date = ?", (str(day),)).fetchone()
+    return json.loads(row[0]) if row else None
+
+
+def plans_between(start, end=None):
+    """{date: plan} for start <= date < end (ISO date strings or date objects)."""
+    sql, params = "SELECT date, plan FROM plans WHERE date >= ?", [str(start)]
+    if end is not None:
+        sql += " AND date < ?"
+        params.append(str(end))
+    rows = _ready().execute(sql + " ORDER BY date", params)
+    return {day: json.loads(plan) for day, plan in rows}
+
+
+def iter_plans_between(start, end=None):
+    """Like plans_between, but yields (date, plan, updated_at) rows straight off the cursor."""
+    sql, params = "SELECT date, plan, updated_at FROM plans WHERE date >= ?", [str(start)]
+    if end is not None:
+        sql += " AND date < ?"
+        params.append(str(end))
+    for day, plan, updated_at in _ready().execute(sql + " ORDER BY date", params):
+        yield day, json.loads(plan), updated_at
+
+
+def recent_plans(limit=60):
+    rows = _ready().execute("SELECT date, plan FROM plans ORDER BY date DESC LIMIT ?", (limit,))
+    return {day: json.loads(plan) for day, plan in rows}
+
+
+def count_plans():
+    return _ready().execute("SELECT COUNT(*) FROM plans").fetchone()[0]
+
+
+def version():
+    _ready()
+    return int(store.get_state("plans_version", 0))
+
+
+def last_modified():
+    """Time of the last plan write or delete (stores from before it was tracked: newest plan)."""
+    conn = _ready()
+    modified = store.get_state("plans_modified")
+    if modified is None:
+        modified = conn.execute("SELECT MAX(updated_at) FROM plans").fetchone()[0]
+    return modified
@@ -0,0 +1,101 @@
+import time
+import threading
+from datetime import date, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+import plan_store
+import tenancy
+from fileutil import file_lock
+
+GENERATE_LOCK = "plan_generation"
+PREWARM_INTERVAL = 3600  # seconds between checks that tomorrow's plan exists
+PREWARM_ACTIVE_DAYS = 14  # only athletes seen this recently get plans generated ahead of time
+WORKERS = 2
+
+_executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="plan-worker")
+_lock = threading.Lock()
+_inflight = {}  # (athlete id, date string) -> Future
+_failed = {}  # (athlete id, date string) -> error message of the last attempt
+_generate = None
+_scheduler = None
+
+
+def get_plan(day):
+    return plan_store.get_plan(day)
+
+
+def _key(day):
+    return (tenancy.current(), str(day))
+
+
+def _run(athlete_id, day):
+    key = (athlete_id, day)
+    with tenancy.use(athlete_id):
+        try:
+            # One generation per athlete at a time across worker processes; whoever
+            # gets the lock second finds the plan already saved and skips the LLM call
+            with file_lock(tenancy.path(GENERATE_LOCK)):
+                if get_plan(day) is None:
+                    plan_store.save_plan(day, _generate(day))
+            _failed.pop(key, None)
+        except Exception as e:
+            _failed[key] = str(e)
+            raise
+        finally:
+            with _lock:
+                _inflight.pop(key, None)
+
+
+def enqueue(day):
+    """Queue plan generation for `day` unless it exists or is already being generated."""
+    key = _key(day)
+    with _lock:
+        if key in _inflight:
+            return _inflight[key]
+        if get_plan(day) is not None:
+            return None
+        _failed.pop(key, None)
+        future = _executor.submit(_run, *key)
+        _inflight[key] = future
+        return future
+
+
+def status(day):
+    """One of "ready", "generating", "failed" or "missing"."""
+    key = _key(day)
+    if get_plan(day) is not None:
+        return "ready"
+    if key in _inflight:
+        return "generating"
+    if key in _failed:
+        return "failed"
+    return "missing"
+
+
+def last_error(day):
+    return _failed.get(_key(day))
+
+
+def prewarm():
+    """Make sure tomorrow's plan is generated ahead of time."""
+    return enqueue(date.today() + timedelta(days=1))
+
+
+def _schedule_loop():
+    while True:
+        for athlete_id in tenancy.active_athletes(PREWARM_ACTIVE_DAYS * 86400):
+            try:
+                with tenancy.use(athlete_id):
+                    prewarm()
+            except Exception:
+                pass
+        time.sleep(PREWARM_INTERVAL)
+
+
+def start(generate_fn):
+    """Register the plan generator and start the pre-warming scheduler."""
+    global _generate, _scheduler
+    _generate = generate_fn
+    if _scheduler is None:
+        _scheduler = threading.Thread(target=_schedule_loop, name="plan-prewarm", daemon=True)
+        _scheduler.start()
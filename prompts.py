@@ -0,0 +1,169 @@
+import json
+from collections import Counter
+
+import plan_store
+
+COACH_SYSTEM_PROMPT = "You are Cadence, an AI triathlon coach. Output ONLY valid JSON with keys: sport, duration_min, intensity, rationale."
+CHAT_SYSTEM_PROMPT = "You are Cadence, an AI triathlon coach. Analyze athlete data and answer clearly with safe, supportive guidance."
+
+# Token budgets per prompt section (rough: ~4 characters per token)
+PROFILE_BUDGET = 300
+PLANS_BUDGET = 300
+ACTIVITIES_BUDGET = 500
+HISTORY_BUDGET = 1200
+HISTORY_TURNS = 5
+RETRIEVAL_BUDGET = 600
+RETRIEVAL_K = 8  # best-matching past items (chat, plans, activities) per question
+PLAN_CONTEXT_LIMIT = 60  # newest plans fetched for chat context
+DETAILED_PLANS = 3  # newest plans that keep their rationale
+ACTIVITIES_WITH_SUMMARY = 3  # activity lines kept when numeric training summary is available
+
+
+def estimate_tokens(text):
+    return (len(text) + 3) // 4
+
+
+def _clip(text, budget):
+    """Cut text to roughly `budget` tokens."""
+    limit = budget * 4
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+
+def _prune(value):
+    """Drop empty strings/None/empty containers so the profile costs only what's filled in."""
+    if isinstance(value, dict):
+        pruned = {k: _prune(v) for k, v in value.items()}
+        return {k: v for k, v in pruned.items() if v not in (None, "", {}, [])}
+    if isinstance(value, list):
+        pruned = [_prune(v) for v in value]
+        return [v for v in pruned if v not in (None, "", {}, [])]
+    return value
+
+
+def profile_text(profile, budget=PROFILE_BUDGET):
+    if not profile:
+        return ""
+    compact = json.dumps(_prune(profile), separators=(",", ":"))
+    return _clip(f"Athlete profile: {compact}", budget)
+
+
+def activity_line(a):
+    line = (
+        f"{a.get('type')} – {a.get('name')} – {a.get('distance_km', 0):.1f} km – "
+        f"{a.get('moving_time_min', 0):.0f} min"
+    )
+    if a.get("avg_hr"):
+        line += f" – HR {a['avg_hr']:.0f} bpm"
+    if a.get("avg_cadence"):
+        line += f" – Cadence {a['avg_cadence']:.0f}"
+    if a.get("avg_power"):
+        line += f" – Power {a['avg_power']:.0f} W"
+    return line
+
+
+def activities_text(activities, budget=ACTIVITIES_BUDGET):
+    """Newest activities first, one line each, until the budget runs out."""
+    lines, used = [], 0
+    for a in activities:
+        line = activity_line(a)
+        cost = estimate_tokens(line) + 1
+        if used + cost > budget:
+            lines.append(f"(+{len(activities) - len(lines)} older activities omitted)")
+            break
+        lines.append(line)
+        used += cost
+    return "\n".join(lines)
+
+
+def _plan_line(day, plan, detailed):
+    line = f"{day}: {plan.get('sport')} {plan.get('duration_min')} min {plan.get('intensity')}"
+    if detailed and plan.get("rationale"):
+        line += f" — {plan['rationale']}"
+    return line
+
+
+def plans_text(plans, budget=PLANS_BUDGET):
+    """Recent plans verbatim, older ones folded into a one-line summary."""
+    days = sorted(plans, reverse=True)
+    lines, used = [], 0
+    for i, day in enumerate(days):
+        line = _plan_line(day, plans[day], detailed=i < DETAILED_PLANS)
+        cost = estimate_tokens(line) + 1
+        if used + cost > budget - 40:  # keep room for the summary line
+            break
+        lines.append(line)
+        used += cost
+
+    older = days[len(lines):]
+    if older:
+        sports = Counter(str(plans[d].get("sport", "?")).capitalize() for d in older)
+        minutes = [plan_store.duration_minutes(plans[d], default=0) for d in older]
+        avg = sum(minutes) / len(minutes)
+        mix = ", ".join(f"{s} {n}" for s, n in sports.most_common())
+        lines.append(f"Earlier ({older[-1]} to {older[0]}): {len(older)} plans ({mix}), avg {avg:.0f} min")
+    return "\n".join(lines)
+
+
+def _activities_section(activities, training_summary):
+    # With the numeric history summary, a few recent lines are enough for the model
+    if training_summary:
+        return f"{training_summary}\n{activities_text(activities[:ACTIVITIES_WITH_SUMMARY])}"
+    return activities_text(activities)
+
+
+def build_plan_messages(profile, activities, training_summary="", day=None, previous_plan=None):
+    """Plan prompt for `day`; the date (and the day before's plan) keep each day's prompt distinct."""
+    workouts = _activities_section(activities, training_summary)
+    user = f"{profile_text(profile)}\nHere are my last workouts:\n{workouts}\n\n"
+    if previous_plan:
+        plan = json.dumps(_prune(previous_plan), separators=(",", ":"))
+        user += _clip(f"Plan for the day before: {plan}", PLANS_BUDGET) + "\n"
+    target = f"for {day:%A %Y-%m-%d}" if day else "for tomorrow"
+    user += f"Generate the training plan {target}."
+    return [
+        {"role": "system", "content": COACH_SYSTEM_PROMPT},
+        {"role": "user", "content": user},
+    ]
+
+
+def _history_tail(history, budget=HISTORY_BUDGET, turns=HISTORY_TURNS):
+    """Last few turns, dropping the oldest ones if they don't fit the budget."""
+    tail = history[-turns:]
+    while len(tail) > 1 and sum(estimate_tokens(m["content"]) for m in tail) > budget:
+        tail = tail[1:]
+    return [{"role": m["role"], "content": _clip(m["content"], budget)} for m in tail]
+
+
+def retrieved_text(items, budget=RETRIEVAL_BUDGET):
+    """Retrieved (kind, day, text) items, best match first, until the budget runs out."""
+    lines, used = [], 0
+    for _, day, text in items:
+        # One long chat message may not crowd out everything else
+        line = _clip(f"{day}: {text}" if day else text, budget // 3)
+        cost = estimate_tokens(line) + 1
+        if used + cost > budget:
+            break
+        lines.append(line)
+        used += cost
+    return "\n".join(lines)
+
+
+def build_chat_messages(profile, plans, activities, history, training_summary="", retrieved=()):
+    """System prompt + budgeted athlete context + the last few turns of the conversation.
+
+    `retrieved` holds older items relevant to the question (see retrieval.search).
+    """
+    context = ""
+    if profile:
+        context += profile_text(profile) + "\n"
+    if plans:
+        context += "Training plans (newest first):\n" + plans_text(plans) + "\n"
+    if activities or training_summary:
+        context += "Recent activities (newest first):\n" + _activities_section(activities, training_summary) + "\n"
+    if retrieved:
+        context += "Relevant history (best matches for the question):\n" + retrieved_text(retrieved) + "\n"
+
+    return [
+        {"role": "system", "content": CHAT_SYSTEM_PROMPT},
+        {"role": "user", "content": context},
+    ] + _history_tail(history)
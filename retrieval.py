@@ -0,0 +1,83 @@
+import re
+import threading
+
+import chat_journal
+import metrics
+import store
+import tenancy
+
+# Full-text index (SQLite FTS5, ranked by BM25) over activities, plans and chat
+# messages, kept in each athlete's own store. Activities and plans are indexed
+# by triggers in store.SCHEMA, chat messages by chat_journal.append.
+INDEX_VERSION = 1  # bump when what gets indexed changes, to rebuild existing stores
+MAX_QUERY_TERMS = 32
+# Words that match nearly every chat message and would drown out the ones that matter
+STOPWORDS = frozenset("""
+a about all an and any are as at be but by can could did do does for from get had has have how i if
+in into is it its just me my no not of on or our should so than that the their them then there they
+this to was we were what when which who why will with would you your
+""".split())
+
+_ready = set()  # athletes (None = legacy mode) whose index was checked this process
+_ready_lock = threading.Lock()
+
+
+def _rebuild(conn):
+    """Index everything written before the index existed."""
+    with conn:
+        conn.execute("DELETE FROM search_docs")
+        # Re-save rows in place so the store's triggers index them
+        conn.execute("UPDATE activities SET name = name")
+        conn.execute("UPDATE plans SET plan = plan")
+        conn.executemany(
+            "INSERT INTO search_docs (kind, ref, day, text) VALUES ('chat', NULL, NULL, ?)",
+            [(store.chat_search_text(m),) for m in chat_journal.read_all()],
+        )
+        conn.execute(
+            "INSERT INTO sync_state (key, value) VALUES ('search_index_version', ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value", (str(INDEX_VERSION),))
+
+
+def _db():
+    conn = store.get_db()
+    athlete_id = tenancy.current()
+    if athlete_id not in _ready:
+        with _ready_lock:
+            if athlete_id not in _ready:
+                if store.get_state("search_index_version") != INDEX_VERSION:
+                    _rebuild(conn)
+                _ready.add(athlete_id)
+    return conn
+
+
+def _match_expression(text):
+    """Any-term FTS5 query for free text (terms quoted, so no query syntax leaks through)."""
+    terms = [t for t in dict.fromkeys(re.findall(r"\w+", text.lower())) if t not in STOPWORDS]
+    terms = terms[:MAX_QUERY_TERMS]
+    return " OR ".join(f'"{term}"' for term in terms)
+
+
+def search(query, k=8, exclude=()):
+    """Best-matching indexed items for `query` as (kind, day, text) tuples.
+
+    `exclude` takes chat messages already in the prompt (the recent turns),
+    so the results don't repeat them; repeated texts are returned once.
+    """
+    expression = _match_expression(query)
+    if not expression:
+        return []
+    skip = {store.chat_search_text(m) for m in exclude}
+    conn = _db()
+    with metrics.span("retrieval"):
+        rows = conn.execute("""
+            SELECT d.kind, d.day, d.text FROM search_fts
+            JOIN search_docs d ON d.id = search_fts.rowid
+            WHERE search_fts MATCH ?
+            ORDER BY bm25(search_fts) LIMIT ?
+        """, (expression, k + len(skip))).fetchall()
+    results = []
+    for row in rows:
+        if row["text"] not in skip:
+            skip.add(row["text"])
+            results.append(tuple(row))
+    return results[:k]
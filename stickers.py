@@ -0,0 +1,130 @@
+import os
+import json
+import hashlib
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageDraw, ImageFont
+
+import geometry
+import metrics
+from fileutil import evict_lru, remove_prefixed
+
+CACHE_DIR = os.getenv("STICKER_CACHE_DIR", os.path.join("cache", "stickers"))
+FONT_PATH = os.getenv("STICKER_FONT", "arial.ttf")
+CANVAS = (600, 600)
+ROUTE_BOX = (50, 240, 550, 560)  # left, top, right, bottom of the area the route is fitted into
+STYLE_VERSION = 1  # bump when the layout changes so old cached renders are ignored
+MAX_FILES = 500
+MAX_BYTES = 50 * 1024 * 1024
+RENDER_WORKERS = 2
+RENDER_TIMEOUT = 15
+
+_fonts = None
+_pool = None
+_pool_lock = threading.Lock()
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+def _load_fonts():
+    """Fonts are loaded once per process (each render worker keeps its own)."""
+    global _fonts
+    if _fonts is None:
+        try:
+            _fonts = {
+                "big": ImageFont.truetype(FONT_PATH, 50),
+                "small": ImageFont.truetype(FONT_PATH, 30),
+            }
+        except OSError:
+            _fonts = {
+                "big": ImageFont.load_default(50),
+                "small": ImageFont.load_default(30),
+            }
+    return _fonts
+
+
+def render_sticker(stats, polyline_data, output_path):
+    """Draw the sticker and write it atomically to `output_path` (runs in a worker process)."""
+    fonts = _load_fonts()
+
+    # Transparent canvas
+    img = Image.new("RGBA", CANVAS, (255, 255, 255, 0))
+    draw = ImageDraw.Draw(img)
+
+    # Write stats
+    draw.text((50, 50), f"{stats['distance_km']} km", fill="white", font=fonts["big"])
+    draw.text((50, 120), f"{stats['moving_time_min']} min", fill="white", font=fonts["small"])
+    if stats.get("avg_hr"):
+        draw.text((50, 180), f"{int(stats['avg_hr'])} bpm", fill="red", font=fonts["small"])
+
+    # If polyline → draw trace
+    if polyline_data:
+        coords = geometry.decode(polyline_data)
+        if len(coords) > 1:
+            points = geometry.project_route(coords, ROUTE_BOX)
+            draw.line([tuple(p) for p in points.tolist()], fill="orange", width=6, joint="curve")
+
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    img.save(tmp_path, "PNG", optimize=True)
+    os.replace(tmp_path, output_path)
+    return output_path
+
+
+def cache_key(stats, polyline_data):
+    payload = json.dumps({"stats": stats, "polyline": polyline_data, "canvas": CANVAS,
+                          "style": STYLE_VERSION}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Forking a threaded server can copy a held lock into the child; start
+            # workers from a clean forkserver process instead (spawn where unavailable)
+            if "forkserver" in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context("forkserver")
+                # Preload only this module: the default also imports __main__, which
+                # under `python app.py` would re-run the whole app in the forkserver
+                context.set_forkserver_preload([__name__])
+            else:
+                context = multiprocessing.get_context("spawn")
+            _pool = ProcessPoolExecutor(max_workers=RENDER_WORKERS, initializer=_load_fonts,
+                                        mp_context=context)
+        return _pool
+
+
+def get_sticker(activity_id, stats, polyline_data=None):
+    """Path of the rendered sticker, rendering it in the worker pool on a cache miss."""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    key = cache_key(stats, polyline_data)
+    path = os.path.join(CACHE_DIR, f"{activity_id}-{key}.png")
+
+    if os.path.exists(path):
+        os.utime(path)  # mark as recently used for eviction
+        metrics.cache_event("stickers", True)
+        return path
+    metrics.cache_event("stickers", False)
+
+    # Identical concurrent requests share one render
+    with _inflight_lock:
+        future = _inflight.get(key)
+        if future is None:
+            future = _get_pool().submit(render_sticker, stats, polyline_data, path)
+            _inflight[key] = future
+    try:
+        with metrics.span("sticker_render"):
+            future.result(timeout=RENDER_TIMEOUT)
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+
+    evict_lru(CACHE_DIR, MAX_FILES, MAX_BYTES, suffixes=(".png",))
+    return path
+
+
+def invalidate(activity_id):
+    """Forget every render of an activity (e.g. after it was edited or deleted on Strava)."""
+    return remove_prefixed(CACHE_DIR, f"{activity_id}-")
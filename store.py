@@ -0,0 +1,385 @@
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+import tenancy
+
+DB_PATH = tenancy.LEGACY_DB
+MAX_CONNECTIONS = 32  # open athlete databases kept per thread
+
+_local = threading.local()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS activities (
+    id INTEGER PRIMARY KEY,
+    name TEXT,
+    sport TEXT,
+    start_date TEXT,
+    start_date_local TEXT,
+    start_ts INTEGER,
+    distance REAL,
+    moving_time INTEGER,
+    avg_hr REAL,
+    avg_cadence REAL,
+    avg_power REAL,
+    calories REAL,
+    summary_polyline TEXT,
+    summary TEXT,
+    detail TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_activities_start ON activities(start_ts DESC);
+CREATE INDEX IF NOT EXISTS idx_activities_sport_start ON activities(sport, start_ts DESC);
+
+CREATE TABLE IF NOT EXISTS route_variants (
+    activity_id INTEGER,
+    level TEXT,
+    source_hash TEXT,
+    polyline TEXT,
+    PRIMARY KEY (activity_id, level)
+);
+
+CREATE TABLE IF NOT EXISTS plans (
+    date TEXT PRIMARY KEY,
+    sport TEXT,
+    duration_min INTEGER,
+    intensity TEXT,
+    plan TEXT,
+    updated_at INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS webhook_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    payload TEXT,
+    received_at INTEGER,
+    status TEXT DEFAULT 'pending',  -- pending | processing | done | failed
+    attempts INTEGER DEFAULT 0,
+    next_attempt INTEGER DEFAULT 0,
+    claimed_at INTEGER,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_webhook_events_pending ON webhook_events(status, next_attempt);
+
+CREATE TABLE IF NOT EXISTS sync_state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+
+-- Retrieval index for chat context (see retrieval.py). Activities and plans
+-- are indexed by the triggers below on every write; chat messages by chat_journal.
+CREATE TABLE IF NOT EXISTS search_docs (
+    id INTEGER PRIMARY KEY,
+    kind TEXT,  -- activity | plan | chat
+    ref TEXT,   -- activity id / plan date (NULL for chat messages)
+    day TEXT,
+    text TEXT,
+    UNIQUE (kind, ref)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5(
+    text, content='search_docs', content_rowid='id', tokenize='porter unicode61'
+);
+CREATE TRIGGER IF NOT EXISTS search_docs_ai AFTER INSERT ON search_docs BEGIN
+    INSERT INTO search_fts (rowid, text) VALUES (new.id, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS search_docs_ad AFTER DELETE ON search_docs BEGIN
+    INSERT INTO search_fts (search_fts, rowid, text) VALUES ('delete', old.id, old.text);
+END;
+CREATE TRIGGER IF NOT EXISTS search_docs_au AFTER UPDATE ON search_docs BEGIN
+    INSERT INTO search_fts (search_fts, rowid, text) VALUES ('delete', old.id, old.text);
+    INSERT INTO search_fts (rowid, text) VALUES (new.id, new.text);
+END;
+
+CREATE TRIGGER IF NOT EXISTS activities_search_ai AFTER INSERT ON activities BEGIN
+    INSERT INTO search_docs (kind, ref, day, text) VALUES ('activity', new.id, substr(new.start_date_local, 1, 10),
+        printf('%s – %s – %.1f km – %d min', new.sport, new.name, coalesce(new.distance, 0) / 1000.0,
+               coalesce(new.moving_time, 0) / 60)
+        || CASE WHEN new.avg_hr THEN printf(' – HR %d bpm', new.avg_hr) ELSE '' END)
+    ON CONFLICT (kind, ref) DO UPDATE SET day = excluded.day, text = excluded.text;
+END;
+CREATE TRIGGER IF NOT EXISTS activities_search_au
+AFTER UPDATE OF name, sport, start_date_local, distance, moving_time, avg_hr ON activities BEGIN
+    INSERT INTO search_docs (kind, ref, day, text) VALUES ('activity', new.id, substr(new.start_date_local, 1, 10),
+        printf('%s – %s – %.1f km – %d min', new.sport, new.name, coalesce(new.distance, 0) / 1000.0,
+               coalesce(new.moving_time, 0) / 60)
+        || CASE WHEN new.avg_hr THEN printf(' – HR %d bpm', new.avg_hr) ELSE '' END)
+    ON CONFLICT (kind, ref) DO UPDATE SET day = excluded.day, text = excluded.text;
+END;
+CREATE TRIGGER IF NOT EXISTS activities_search_ad AFTER DELETE ON activities BEGIN
+    DELETE FROM search_docs WHERE kind = 'activity' AND ref = CAST(old.id AS TEXT);
+END;
+
+CREATE TRIGGER IF NOT EXISTS plans_search_ai AFTER INSERT ON plans BEGIN
+    INSERT INTO search_docs (kind, ref, day, text) VALUES ('plan', new.date, new.date,
+        printf('Plan: %s %s min %s', new.sport, new.duration_min, new.intensity)
+        || coalesce(' — ' || json_extract(new.plan, '$.rationale'), ''))
+    ON CONFLICT (kind, ref) DO UPDATE SET day = excluded.day, text = excluded.text;
+END;
+CREATE TRIGGER IF NOT EXISTS plans_search_au AFTER UPDATE ON plans BEGIN
+    INSERT INTO search_docs (kind, ref, day, text) VALUES ('plan', new.date, new.date,
+        printf('Plan: %s %s min %s', new.sport, new.duration_min, new.intensity)
+        || coalesce(' — ' || json_extract(new.plan, '$.rationale'), ''))
+    ON CONFLICT (kind, ref) DO UPDATE SET day = excluded.day, text = excluded.text;
+END;
+CREATE TRIGGER IF NOT EXISTS plans_search_ad AFTER DELETE ON plans BEGIN
+    DELETE FROM search_docs WHERE kind = 'plan' AND ref = old.date;
+END;
+"""
+
+SORT_COLUMNS = {
+    "date": "start_ts",
+    "distance": "distance",
+    "duration": "moving_time",
+    "name": "name",
+}
+
+
+def get_db():
+    """This thread's connection to the current athlete's database (schema created on first use)."""
+    path = tenancy.path("cadence.db", legacy=DB_PATH)
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = OrderedDict()
+    conn = conns.get(path)
+    if conn is not None:
+        conns.move_to_end(path)
+        return conn
+
+    conn = sqlite3.connect(path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    conns[path] = conn
+    # Bound open files per thread when serving many athletes
+    while len(conns) > MAX_CONNECTIONS:
+        conns.popitem(last=False)[1].close()
+    return conn
+
+
+def get_shared_db():
+    """Node-level database (legacy root), for state that isn't any one athlete's."""
+    with tenancy.use(None):
+        return get_db()
+
+
+def iso_to_ts(value):
+    if not value:
+        return None
+    return int(datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp())
+
+
+def _row_values(act):
+    """Flatten a Strava activity (summary or detail) into table columns."""
+    return {
+        "id": act["id"],
+        "name": act.get("name"),
+        "sport": act.get("type") or act.get("sport_type"),
+        "start_date": act.get("start_date"),
+        "start_date_local": act.get("start_date_local"),
+        "start_ts": iso_to_ts(act.get("start_date")),
+        "distance": act.get("distance", 0),
+        "moving_time": act.get("moving_time", 0),
+        "avg_hr": act.get("average_heartrate"),
+        "avg_cadence": act.get("average_cadence"),
+        "avg_power": act.get("average_watts"),
+        "calories": act.get("calories"),
+        "summary_polyline": (act.get("map") or {}).get("summary_polyline"),
+    }
+
+
+def _bump_version(conn):
+    # Version counter for caches of activity-derived pages
+    conn.execute(
+        "INSERT INTO sync_state (key, value) VALUES ('activities_version', '1') "
+        "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1")
+
+
+def version():
+    return int(get_state("activities_version", 0))
+
+
+def upsert_activities(activities):
+    """Insert or refresh summary rows; cached details are kept."""
+    rows = []
+    for act in activities:
+        values = _row_values(act)
+        values["summary"] = json.dumps(act)
+        rows.append(values)
+    if not rows:
+        return 0
+
+    conn = get_db()
+    with conn:
+        conn.executemany("""
+            INSERT INTO activities (id, name, sport, start_date, start_date_local, start_ts,
+                distance, moving_time, avg_hr, avg_cadence, avg_power, calories,
+                summary_polyline, summary)
+            VALUES (:id, :name, :sport, :start_date, :start_date_local, :start_ts,
+                :distance, :moving_time, :avg_hr, :avg_cadence, :avg_power, :calories,
+                :summary_polyline, :summary)
+            ON CONFLICT(id) DO UPDATE SET
+                name=excluded.name, sport=excluded.sport,
+                start_date=excluded.start_date, start_date_local=excluded.start_date_local,
+                start_ts=excluded.start_ts, distance=excluded.distance,
+                moving_time=excluded.moving_time, avg_hr=excluded.avg_hr,
+                avg_cadence=excluded.avg_cadence, avg_power=excluded.avg_power,
+                calories=COALESCE(excluded.calories, activities.calories),
+                summary_polyline=excluded.summary_polyline, summary=excluded.summary
+        """, rows)
+        _bump_version(conn)
+    return len(rows)
+
+
+def save_detail(detail):
+    """Store a full activity detail payload alongside its summary columns."""
+    save_details([detail])
+
+
+def save_details(details):
+    """Bulk version of save_detail: one transaction for the whole batch."""
+    rows = []
+    for detail in details:
+        values = _row_values(detail)
+        values["detail"] = json.dumps(detail)
+        rows.append(values)
+    if not rows:
+        return 0
+    conn = get_db()
+    with conn:
+        conn.executemany("""
+            INSERT INTO activities (id, name, sport, start_date, start_date_local, start_ts,
+                distance, moving_time, avg_hr, avg_cadence, avg_power, calories,
+                summary_polyline, detail)
+            VALUES (:id, :name, :sport, :start_date, :start_date_local, :start_ts,
+                :distance, :moving_time, :avg_hr, :avg_cadence, :avg_power, :calories,
+                :summary_polyline, :detail)
+            ON CONFLICT(id) DO UPDATE SET
+                name=excluded.name, sport=excluded.sport,
+                start_date=excluded.start_date, start_date_local=excluded.start_date_local,
+                start_ts=excluded.start_ts, distance=excluded.distance,
+                moving_time=excluded.moving_time, avg_hr=excluded.avg_hr,
+                avg_cadence=excluded.avg_cadence, avg_power=excluded.avg_power,
+                calories=excluded.calories, summary_polyline=excluded.summary_polyline,
+                detail=excluded.detail
+        """, rows)
+        _bump_version(conn)
+    return len(rows)
+
+
+def ids_without_detail(limit=None):
+    """Newest-first ids of activities whose detail has not been fetched yet."""
+    sql = "SELECT id FROM activities WHERE detail IS NULL ORDER BY start_ts DESC"
+    if limit:
+        sql += f" LIMIT {int(limit)}"
+    return [row[0] for row in get_db().execute(sql)]
+
+
+def all_ids():
+    """Every stored activity id, newest first."""
+    return [row[0] for row in get_db().execute("SELECT id FROM activities ORDER BY start_ts DESC")]
+
+
+def delete_activity(activity_id):
+    conn = get_db()
+    with conn:
+        conn.execute("DELETE FROM activities WHERE id = ?", (activity_id,))
+        conn.execute("DELETE FROM route_variants WHERE activity_id = ?", (activity_id,))
+        _bump_version(conn)
+
+
+def _to_dict(row):
+    act = dict(row)
+    act["summary"] = json.loads(act["summary"]) if act.get("summary") else None
+    act["detail"] = json.loads(act["detail"]) if act.get("detail") else None
+    return act
+
+
+def get_activity(activity_id):
+    row = get_db().execute("SELECT * FROM activities WHERE id = ?", (activity_id,)).fetchone()
+    return _to_dict(row) if row else None
+
+
+def query_activities(page=1, per_page=20, sport=None, start_ts=None, end_ts=None,
+                     sort="date", descending=True):
+    """Page through stored activities, optionally filtered by sport and date range."""
+    where, params = [], []
+    if sport:
+        where.append("sport = ?")
+        params.append(sport)
+    if start_ts is not None:
+        where.append("start_ts >= ?")
+        params.append(start_ts)
+    if end_ts is not None:
+        where.append("start_ts < ?")
+        params.append(end_ts)
+
+    column = SORT_COLUMNS.get(sort, "start_ts")
+    sql = "SELECT * FROM activities"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += f" ORDER BY {column} {'DESC' if descending else 'ASC'}, id DESC LIMIT ? OFFSET ?"
+    params += [per_page, (max(page, 1) - 1) * per_page]
+
+    return [_to_dict(row) for row in get_db().execute(sql, params)]
+
+
+def count_activities():
+    return get_db().execute("SELECT COUNT(*) FROM activities").fetchone()[0]
+
+
+def list_sports():
+    rows = get_db().execute("SELECT DISTINCT sport FROM activities WHERE sport IS NOT NULL ORDER BY sport")
+    return [row[0] for row in rows]
+
+
+def latest_start_ts():
+    return get_db().execute("SELECT MAX(start_ts) FROM activities").fetchone()[0]
+
+
+def get_route_variant(activity_id, level, source_hash):
+    row = get_db().execute(
+        "SELECT polyline FROM route_variants WHERE activity_id = ? AND level = ? AND source_hash = ?",
+        (activity_id, level, source_hash),
+    ).fetchone()
+    return row[0] if row else None
+
+
+def save_route_variants(activity_id, source_hash, variants):
+    conn = get_db()
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO route_variants (activity_id, level, source_hash, polyline) "
+            "VALUES (?, ?, ?, ?)",
+            [(activity_id, level, source_hash, encoded) for level, encoded in variants.items()],
+        )
+
+
+def chat_search_text(message):
+    """How a chat message is stored in the retrieval index."""
+    speaker = "Athlete" if message.get("role") == "user" else "Coach"
+    return f"{speaker}: {message.get('content', '')}"
+
+
+def index_chat_messages(messages, day=None):
+    conn = get_db()
+    with conn:
+        conn.executemany(
+            "INSERT INTO search_docs (kind, ref, day, text) VALUES ('chat', NULL, ?, ?)",
+            [(day, chat_search_text(m)) for m in messages],
+        )
+
+
+def get_state(key, default=None):
+    row = get_db().execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+    return json.loads(row[0]) if row else default
+
+
+def set_state(key, value):
+    conn = get_db()
+    with conn:
+        conn.execute(
+            "INSERT INTO sync_state (key, value) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value=excluded.value",
+            (key, json.dumps(value)),
+        )
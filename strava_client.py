@@ -0,0 +1,248 @@
+import os
+import re
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import metrics
+
+API_BASE = os.getenv("STRAVA_API_BASE", "https://www.strava.com/api/v3")
+OAUTH_URL = os.getenv("STRAVA_OAUTH_URL", "https://www.strava.com/oauth/token")
+
+TIMEOUT = (3.05, 15)  # (connect, read) seconds
+MAX_WAIT = 10  # longest we'll block a request waiting for rate-limit budget
+SAFETY_MARGIN = 5  # requests kept in reserve below Strava's 15-minute limit
+CACHE_SIZE = 512
+FAN_OUT_WORKERS = 8
+DEFAULT_CALL_TIMEOUT = 5  # seconds a single fanned-out call may take
+
+# Per-endpoint freshness; anything else is not cached
+CACHE_TTLS = [
+    (re.compile(r"^/activities/\d+$"), 3600),
+    (re.compile(r"^/activities/\d+/photos$"), 3600),
+    (re.compile(r"^/activities/\d+/streams$"), 86400),
+    (re.compile(r"^/athlete/activities$"), 60),
+    (re.compile(r"^/athlete$"), 3600),
+]
+
+
+class StravaError(requests.HTTPError):
+    """Non-2xx answer from Strava (or a request we refused to send)."""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class RateLimited(StravaError):
+    pass
+
+
+class TokenBucket:
+    """Token bucket refilled at Strava's 15-minute rate and clamped by its usage headers."""
+
+    def __init__(self, limit=100, window=900):
+        self.limit = limit
+        self.window = window
+        self.tokens = float(limit - SAFETY_MARGIN)
+        self.daily_exhausted_until = 0
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        rate = self.limit / self.window
+        self.tokens = min(self.limit - SAFETY_MARGIN, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+
+    def acquire(self, max_wait=MAX_WAIT):
+        """Take one token, sleeping for refill up to `max_wait` seconds."""
+        deadline = time.monotonic() + max_wait
+        while True:
+            with self.lock:
+                if time.time() < self.daily_exhausted_until:
+                    raise RateLimited("Strava daily rate limit reached", status=429)
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) * self.window / self.limit
+            if time.monotonic() + wait > deadline:
+                raise RateLimited("Strava rate limit budget exhausted", status=429)
+            time.sleep(wait)
+
+    def update(self, headers):
+        """Resync with X-RateLimit-Limit / X-RateLimit-Usage ("15min,daily")."""
+        limit = headers.get("X-RateLimit-Limit")
+        usage = headers.get("X-RateLimit-Usage")
+        if not limit or not usage:
+            return
+        try:
+            short_limit, daily_limit = (int(v) for v in limit.split(","))
+            short_used, daily_used = (int(v) for v in usage.split(","))
+        except ValueError:
+            return
+
+        with self.lock:
+            self._refill()
+            self.limit = short_limit
+            self.tokens = min(self.tokens, short_limit - short_used - SAFETY_MARGIN)
+            if daily_used >= daily_limit - SAFETY_MARGIN:
+                # Daily window resets at midnight UTC
+                self.daily_exhausted_until = (int(time.time()) // 86400 + 1) * 86400
+
+    def exhaust(self):
+        with self.lock:
+            self.tokens = min(self.tokens, 0)
+            self.updated = time.monotonic()
+
+
+class ResponseCache:
+    """LRU of parsed JSON bodies with TTL and ETag for conditional revalidation."""
+
+    def __init__(self, maxsize=CACHE_SIZE):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry:
+                self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key, body, ttl, etag):
+        with self.lock:
+            self.entries[key] = {"body": body, "expires": time.time() + ttl, "etag": etag}
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def touch(self, key, ttl):
+        with self.lock:
+            if key in self.entries:
+                self.entries[key]["expires"] = time.time() + ttl
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def invalidate(self, path):
+        """Drop cached responses for `path` and everything below it."""
+        with self.lock:
+            for key in [k for k in self.entries if k[0] == path or k[0].startswith(path + "/")]:
+                del self.entries[key]
+
+
+def _make_session():
+    s = requests.Session()
+    retry = Retry(total=2, backoff_factor=0.3, status_forcelist=[502, 503, 504],
+                  allowed_methods=["GET"])
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=32, max_retries=retry)
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
+    return s
+
+
+session = _make_session()
+bucket = TokenBucket()
+cache = ResponseCache()
+_executor = ThreadPoolExecutor(max_workers=FAN_OUT_WORKERS, thread_name_prefix="strava-fanout")
+
+
+def _ttl_for(path):
+    for pattern, ttl in CACHE_TTLS:
+        if pattern.match(path):
+            return ttl
+    return None
+
+
+def _cache_key(path, params, access_token):
+    # The token is part of the key so one athlete never sees another's cached data
+    token_hash = hashlib.sha256((access_token or "").encode()).hexdigest()[:16]
+    return (path, tuple(sorted((params or {}).items())), token_hash)
+
+
+def get(path, access_token, params=None, ttl=None, use_cache=True, max_wait=MAX_WAIT):
+    """GET an API path (e.g. "/activities/123") and return the decoded JSON.
+
+    `max_wait` bounds how long to block for rate-limit budget; batch jobs pass
+    a full window so they slow down instead of failing.
+    """
+    ttl = _ttl_for(path) if ttl is None else ttl
+    key = _cache_key(path, params, access_token)
+    entry = cache.get(key) if use_cache and ttl else None
+    if entry and entry["expires"] > time.time():
+        metrics.cache_event("strava", True)
+        return entry["body"]
+    if use_cache and ttl:
+        metrics.cache_event("strava", False)
+
+    headers = {"Authorization": f"Bearer {access_token}"}
+    if entry and entry["etag"]:
+        headers["If-None-Match"] = entry["etag"]
+
+    bucket.acquire(max_wait)
+    with metrics.span("strava"):
+        r = session.get(f"{API_BASE}{path}", headers=headers, params=params, timeout=TIMEOUT)
+    bucket.update(r.headers)
+
+    if r.status_code == 304 and entry:
+        cache.touch(key, ttl)
+        return entry["body"]
+    if r.status_code == 429:
+        bucket.exhaust()
+        raise RateLimited("Strava returned 429", status=429)
+    if not r.ok:
+        raise StravaError(f"Strava {r.status_code} for {path}", status=r.status_code)
+
+    body = r.json()
+    if use_cache and ttl:
+        cache.put(key, body, ttl, r.headers.get("ETag"))
+    return body
+
+
+def post_oauth(data):
+    """POST to the OAuth token endpoint (not counted against the API rate limit)."""
+    with metrics.span("strava_oauth"):
+        r = session.post(OAUTH_URL, data=data, timeout=TIMEOUT)
+    if not r.ok:
+        raise StravaError(f"Strava OAuth {r.status_code}", status=r.status_code)
+    return r.json()
+
+
+def fetch_concurrently(calls, timeouts=None, required=()):
+    """Run independent upstream calls in parallel.
+
+    `calls` maps a name to a zero-argument callable. Every call gets its own
+    timeout (`timeouts[name]`, default DEFAULT_CALL_TIMEOUT), all measured from
+    the same start, so the whole fan-out takes as long as the slowest call.
+    Optional calls that fail or time out come back as None; failures of calls
+    listed in `required` are re-raised.
+    """
+    timeouts = timeouts or {}
+    start = time.monotonic()
+    futures = {name: _executor.submit(metrics.propagate(fn)) for name, fn in calls.items()}
+
+    results = {}
+    for name, future in futures.items():
+        remaining = start + timeouts.get(name, DEFAULT_CALL_TIMEOUT) - time.monotonic()
+        try:
+            results[name] = future.result(timeout=max(remaining, 0))
+        except FutureTimeout:
+            future.cancel()
+            if name in required:
+                raise StravaError(f"Strava call '{name}' timed out", status=504)
+            results[name] = None
+        except Exception:
+            if name in required:
+                raise
+            results[name] = None
+    return results
@@ -0,0 +1,166 @@
+import os
+import shutil
+import threading
+from functools import lru_cache
+
+import numpy as np
+
+import strava_client
+import tenancy
+
+STREAMS_DIR = os.path.join(tenancy.DATA_DIR, "streams")  # legacy mode; athletes keep theirs in their partition
+
+# One .npy file per channel under data/streams/<activity_id>/, opened with mmap
+CHANNELS = {
+    "time": np.uint32,        # seconds since start
+    "distance": np.float32,   # metres
+    "latlng": np.float32,     # (n, 2)
+    "altitude": np.float32,   # metres
+    "heartrate": np.uint16,   # bpm
+    "cadence": np.uint16,     # rpm / half-spm as reported by Strava
+    "watts": np.uint16,
+    "velocity_smooth": np.float32,  # m/s
+}
+CHART_CHANNELS = ("heartrate", "altitude", "velocity_smooth", "cadence", "watts")
+CHART_POINTS = 800
+
+_fetch_lock = threading.Lock()
+_inflight = {}
+
+
+def _dir(activity_id):
+    return os.path.join(tenancy.path("streams", legacy=STREAMS_DIR), str(int(activity_id)))
+
+
+def has_streams(activity_id):
+    """True once streams were fetched (manual activities get an empty directory)."""
+    return os.path.isdir(_dir(activity_id))
+
+
+def save(activity_id, payload):
+    """Write Strava's key_by_type streams payload as typed arrays, atomically per activity."""
+    final = _dir(activity_id)
+    tmp = f"{final}.{os.getpid()}.{threading.get_ident()}.tmp"
+    os.makedirs(tmp, exist_ok=True)
+    for channel, dtype in CHANNELS.items():
+        data = (payload.get(channel) or {}).get("data")
+        if not data:
+            continue
+        # Gaps (None) become 0; Strava only sends them in pathological recordings
+        values = np.asarray([0 if v is None else v for v in data], dtype=np.float64)
+        if np.issubdtype(dtype, np.integer):
+            info = np.iinfo(dtype)
+            values = np.clip(np.rint(values), info.min, info.max)
+        np.save(os.path.join(tmp, f"{channel}.npy"), values.astype(dtype))
+    shutil.rmtree(final, ignore_errors=True)
+    os.replace(tmp, final)
+
+
+def _load(directory, channel):
+    path = os.path.join(directory, f"{channel}.npy")
+    if not os.path.exists(path):
+        return None
+    return np.load(path, mmap_mode="r")
+
+
+def load(activity_id, channel):
+    """Memory-mapped channel array, or None when it wasn't recorded."""
+    return _load(_dir(activity_id), channel)
+
+
+def channels(activity_id):
+    directory = _dir(activity_id)
+    if not os.path.isdir(directory):
+        return []
+    return [c for c in CHANNELS if os.path.exists(os.path.join(directory, f"{c}.npy"))]
+
+
+def fetch(access_token, activity_id):
+    """Download and store an activity's streams once (concurrent callers share the request)."""
+    if has_streams(activity_id):
+        return True
+    key = _dir(activity_id)
+    with _fetch_lock:
+        event = _inflight.get(key)
+        owner = event is None
+        if owner:
+            event = _inflight[key] = threading.Event()
+    if not owner:
+        event.wait(strava_client.TIMEOUT[1] * 2)
+        return has_streams(activity_id)
+    try:
+        try:
+            payload = strava_client.get(
+                f"/activities/{activity_id}/streams", access_token,
+                params={"keys": ",".join(CHANNELS), "key_by_type": "true"}, use_cache=False,
+            )
+        except strava_client.StravaError as e:
+            if e.status != 404:  # manual activities have no streams
+                raise
+            payload = {}
+        save(activity_id, payload)
+    finally:
+        with _fetch_lock:
+            _inflight.pop(key, None)
+        event.set()
+    return has_streams(activity_id)
+
+
+def invalidate(activity_id):
+    shutil.rmtree(_dir(activity_id), ignore_errors=True)
+
+
+def lttb(x, y, threshold):
+    """Largest-Triangle-Three-Buckets: indices of `threshold` points that keep the shape.
+
+    First and last points are always kept; every bucket in between contributes
+    the point forming the largest triangle with the previous pick and the next
+    bucket's average, which preserves peaks and troughs.
+    """
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    # Works bucket by bucket on slices, so memory-mapped inputs are paged in
+    # a little at a time instead of being copied whole
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    picked = np.empty(threshold, dtype=np.int64)
+    picked[0], picked[-1] = 0, n - 1
+
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        nxt_start, nxt_end = edges[i + 1], (edges[i + 2] if i + 2 < len(edges) else n)
+        avg_x = x[nxt_start:nxt_end].mean(dtype=np.float64)
+        avg_y = y[nxt_start:nxt_end].mean(dtype=np.float64)
+        ax, ay = float(x[a]), float(y[a])
+        bx = x[start:end].astype(np.float64)
+        by = y[start:end].astype(np.float64)
+        area = np.abs((ax - avg_x) * (by - ay) - (ax - bx) * (avg_y - ay))
+        a = start + int(area.argmax())
+        picked[i + 1] = a
+    return picked
+
+
+def chart_data(activity_id, points=CHART_POINTS):
+    """Downsampled {channel: [[t, value], ...]} for the detail page charts."""
+    directory = _dir(activity_id)
+    try:
+        version = os.stat(directory).st_mtime_ns
+    except FileNotFoundError:
+        return {}
+    return _chart_data(directory, points, version)
+
+
+@lru_cache(maxsize=64)
+def _chart_data(directory, points, version):
+    time_axis = _load(directory, "time")
+    if time_axis is None:
+        return {}
+    series = {}
+    for channel in CHART_CHANNELS:
+        values = _load(directory, channel)
+        if values is None or not len(values):
+            continue
+        idx = lttb(time_axis, values, points)
+        series[channel] = np.column_stack((time_axis[idx], values[idx])).round(2).tolist()
+    return series
@@ -0,0 +1,88 @@
+import time
+import requests
+
+import analytics
+import store
+import strava_client
+
+SYNC_INTERVAL = 300  # seconds between incremental syncs triggered by page views
+WEBHOOK_SYNC_INTERVAL = 6 * 3600  # safety-net sync once Strava pushes events to us
+PAGE_SIZE = 100
+
+# Callables run (without arguments) after a sync stored new activities
+on_new_activities = []
+
+
+def sync_activities(access_token, max_pages=None):
+    """Pull activities newer than the latest one we have, using Strava's `after=` cursor.
+
+    An empty store starts from the newest activities instead (older history
+    is `flask backfill`'s job). With `max_pages`, a sync that stops early
+    leaves the rest to the next one.
+    """
+    after = store.latest_start_ts()
+    page = 1
+    new = 0
+    while True:
+        params = {"per_page": PAGE_SIZE, "page": page}
+        if after:
+            params["after"] = after
+        batch = strava_client.get("/athlete/activities", access_token, params=params, use_cache=False)
+        new += store.upsert_activities(batch)
+        if len(batch) < PAGE_SIZE:
+            break
+        if max_pages is not None and page >= max_pages:
+            break
+        page += 1
+
+    if not after or len(batch) < PAGE_SIZE:
+        store.set_state("last_sync", int(time.time()))
+    if new:
+        for callback in on_new_activities:
+            callback()
+    return new
+
+
+def _claim(max_age):
+    """Take the next sync for this athlete, unless another request (in any process) already has it."""
+    now = int(time.time())
+    conn = store.get_db()
+    with conn:
+        conn.execute("INSERT OR IGNORE INTO sync_state (key, value) VALUES ('sync_claimed', '0')")
+        claimed = conn.execute(
+            "UPDATE sync_state SET value = ? WHERE key = 'sync_claimed' AND CAST(value AS INTEGER) <= ?",
+            (str(now), now - max_age)).rowcount
+    return claimed == 1
+
+
+def sync_if_stale(access_token, max_age=None):
+    """Run an incremental sync unless one finished (or started) within `max_age` seconds.
+
+    Only one request runs it; the others serve what's stored meanwhile.
+    """
+    if max_age is None:
+        max_age = WEBHOOK_SYNC_INTERVAL if store.get_state("webhook_active") else SYNC_INTERVAL
+    last = store.get_state("last_sync", 0)
+    if time.time() - last < max_age or not _claim(max_age):
+        return 0
+    try:
+        return sync_activities(access_token)
+    except requests.RequestException:
+        # Serve whatever is stored locally; the next page view retries
+        store.set_state("sync_claimed", 0)
+        return 0
+
+
+def get_activity_detail(access_token, activity_id):
+    """Return the full activity payload, fetching it from Strava only once."""
+    act = store.get_activity(activity_id)
+    if act and act["detail"]:
+        return act["detail"]
+
+    detail = strava_client.get(
+        f"/activities/{activity_id}", access_token,
+        params={"include_all_efforts": "false"},
+    )
+    store.save_detail(detail)
+    analytics.append_detail(detail)
+    return detail
@@ -0,0 +1,172 @@
+import os
+import time
+import sqlite3
+import threading
+import contextvars
+from contextlib import contextmanager
+
+from fileutil import file_lock
+
+# Every athlete gets a directory of their own: SQLite store, tokens, profile,
+# chat journal, split columns and streams. Nothing in it is shared with other
+# athletes, so one athlete's writes never wait on another's locks.
+DATA_DIR = os.getenv("CADENCE_DATA_DIR", "data")
+ATHLETES_DIR = os.path.join(DATA_DIR, "athletes")
+LEGACY_MARKER = os.path.join(ATHLETES_DIR, ".legacy_adopted")
+LEGACY_DB = os.getenv("CADENCE_DB", "cadence.db")  # stays on as the node-level (shared) database
+# Single-athlete files and directories from before tenancy, moved to the first athlete who logs in
+LEGACY_FILES = ("profile.json", "plan.json", "chat_history.json", "chat_history.jsonl",
+                "chat_history.idx", "chat_history.archive.jsonl", "activities.json", "tokens.json")
+LEGACY_DIRS = ("splits", "streams")  # under DATA_DIR
+# What the node-level database keeps after adoption; everything else in it was the athlete's
+SHARED_TABLES = ("webhook_events",)
+SHARED_STATE = ("webhook_subscription_id",)
+TOUCH_INTERVAL = 3600  # seconds between "last seen" updates per athlete
+
+_current = contextvars.ContextVar("athlete_id", default=None)
+_touched = {}
+_adopt_lock = threading.Lock()
+
+
+def current():
+    """Athlete id the current request/job runs for (None = legacy single-athlete mode)."""
+    return _current.get()
+
+
+def activate(athlete_id):
+    """Bind the current context (a request) to an athlete."""
+    _current.set(int(athlete_id) if athlete_id is not None else None)
+
+
+@contextmanager
+def use(athlete_id):
+    """Run a block (background job, CLI command) on behalf of an athlete."""
+    token = _current.set(int(athlete_id) if athlete_id is not None else None)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def bind(fn):
+    """Wrap `fn` to run for the current athlete on any thread (pool workers don't inherit it)."""
+    athlete_id = _current.get()
+
+    def run(*args, **kwargs):
+        with use(athlete_id):
+            return fn(*args, **kwargs)
+    return run
+
+
+def partition(athlete_id):
+    return os.path.join(ATHLETES_DIR, str(int(athlete_id)))
+
+
+def path(name, legacy=None):
+    """Location of a per-athlete file; in legacy mode the pre-tenancy location."""
+    athlete_id = _current.get()
+    if athlete_id is None:
+        return legacy if legacy is not None else name
+    return os.path.join(partition(athlete_id), name)
+
+
+def athletes():
+    """Ids of every athlete with a partition on this node."""
+    try:
+        entries = os.scandir(ATHLETES_DIR)
+    except FileNotFoundError:
+        return []
+    with entries:
+        return [int(e.name) for e in entries if e.is_dir() and e.name.isdigit()]
+
+
+def legacy_mode():
+    """True until the first athlete connects: the app then serves the root-level files."""
+    return not os.path.exists(LEGACY_MARKER) and not athletes()
+
+
+def exists(athlete_id):
+    return os.path.isdir(partition(athlete_id))
+
+
+def _tables(conn):
+    return [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+            if not row[0].startswith(("sqlite_", "search_fts"))]
+
+
+def _adopt_db(directory):
+    """Copy the legacy database into the partition, then keep only node-level state at the root."""
+    src = sqlite3.connect(LEGACY_DB, timeout=30)
+    dst = sqlite3.connect(os.path.join(directory, "cadence.db"), timeout=30)
+    try:
+        src.backup(dst)
+        marks = ",".join("?" * len(SHARED_STATE))
+        with dst:
+            for table in SHARED_TABLES:
+                dst.execute(f"DELETE FROM {table}")
+            dst.execute(f"DELETE FROM sync_state WHERE key IN ({marks})", SHARED_STATE)
+        with src:
+            for table in _tables(src):
+                if table == "sync_state":
+                    src.execute(f"DELETE FROM sync_state WHERE key NOT IN ({marks})", SHARED_STATE)
+                elif table not in SHARED_TABLES:
+                    src.execute(f"DELETE FROM {table}")
+    finally:
+        src.close()
+        dst.close()
+
+
+def _adopt(directory):
+    for name in LEGACY_FILES:
+        if os.path.exists(name):
+            os.replace(name, os.path.join(directory, name))
+    for name in LEGACY_DIRS:
+        if os.path.isdir(os.path.join(DATA_DIR, name)):
+            os.replace(os.path.join(DATA_DIR, name), os.path.join(directory, name))
+    if os.path.exists(LEGACY_DB):
+        _adopt_db(directory)
+
+
+def ensure(athlete_id, legacy_owner=None):
+    """Create an athlete's partition; the first one also takes over the legacy data.
+
+    The legacy files move into the partition (the root database is copied and
+    emptied of athlete data), so nothing of theirs stays readable at the root.
+    `legacy_owner` is the athlete id recorded in the old tokens.json, if any;
+    when known, only that athlete adopts the legacy data.
+    """
+    directory = partition(athlete_id)
+    if os.path.isdir(directory):
+        return directory
+    with _adopt_lock:
+        os.makedirs(ATHLETES_DIR, exist_ok=True)
+        with file_lock(LEGACY_MARKER):  # other worker processes
+            adopt = not os.path.exists(LEGACY_MARKER) and legacy_owner in (None, int(athlete_id))
+            os.makedirs(directory, exist_ok=True)
+            if adopt:
+                _adopt(directory)
+                with open(LEGACY_MARKER, "w") as f:
+                    f.write(str(athlete_id))
+    return directory
+
+
+def touch(athlete_id):
+    """Record activity (at most hourly) so background jobs can skip dormant athletes."""
+    now = time.time()
+    if athlete_id is None or now - _touched.get(athlete_id, 0) < TOUCH_INTERVAL:
+        return
+    _touched[athlete_id] = now
+    try:
+        os.utime(partition(athlete_id))
+    except FileNotFoundError:
+        pass
+
+
+def active_athletes(max_age):
+    """Athletes seen within `max_age` seconds ([None] in legacy mode)."""
+    if legacy_mode():
+        return [None]
+    cutoff = time.time() - max_age
+    with os.scandir(ATHLETES_DIR) as entries:
+        return [int(e.name) for e in entries
+                if e.is_dir() and e.name.isdigit() and e.stat().st_mtime >= cutoff]
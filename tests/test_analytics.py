@@ -0,0 +1,52 @@
+"""Split column storage (appends, in-place updates, the per-process column cache) and load metrics.
+
+    python -m pytest tests/test_analytics.py
+"""
+import numpy as np
+import pytest
+
+import analytics
+
+
+@pytest.fixture(autouse=True)
+def splits_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(analytics, "SPLITS_DIR", str(tmp_path / "splits"))
+    analytics._cache.clear()
+
+
+def _detail(heartrate, splits=2):
+    return {"id": 7, "type": "Run", "start_date": "2026-10-01T07:00:00Z",
+            "splits_metric": [{"split": i + 1, "distance": 1000, "moving_time": 300, "average_speed": 3.3,
+                               "average_heartrate": heartrate} for i in range(splits)]}
+
+
+def test_update_with_same_split_count_is_seen():
+    assert analytics.replace_detail(_detail(140))
+    assert analytics.load_columns()["average_heartrate"].tolist() == [140, 140]
+
+    assert analytics.replace_detail(_detail(175))
+    assert analytics.load_columns()["average_heartrate"].tolist() == [175, 175]
+    assert not analytics.replace_detail(_detail(175))
+
+
+def test_update_with_fewer_splits_replaces_them():
+    analytics.replace_detail(_detail(150, splits=3))
+    analytics.replace_detail(_detail(150, splits=1))
+    columns = analytics.load_columns()
+    assert columns["activity_id"].tolist() == [7]
+    assert np.all(columns["average_heartrate"] == 150)
+
+
+def test_training_load_matches_daily_recurrence():
+    days = np.array([0, 1, 1, 5, 30, 31], dtype=np.int64)
+    cols = {"start_ts": days * 86400 + 3600}
+    load = np.array([50, 20, 30, 80, 60, 40], dtype=np.float64)
+
+    atl = ctl = 0.0
+    for day in range(32):
+        daily = load[days == day].sum()
+        atl += (daily - atl) / analytics.ATL_DAYS
+        ctl += (daily - ctl) / analytics.CTL_DAYS
+
+    result = analytics.training_load(cols, load)
+    assert result["atl"] == round(atl, 1) and result["ctl"] == round(ctl, 1)
@@ -0,0 +1,141 @@
+"""Strava push events end to end: fake Strava -> webhook route -> queue -> store, splits and caches.
+
+Runs the app and fakes/strava.py as real servers in a scratch directory:
+
+    python -m pytest tests/test_webhooks.py
+"""
+import os
+import sys
+import json
+import time
+import socket
+import sqlite3
+import subprocess
+
+import numpy as np
+import pytest
+import requests
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TIMEOUT = 15
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_for(url):
+    deadline = time.time() + TIMEOUT
+    while time.time() < deadline:
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up")
+
+
+def _eventually(check):
+    """Poll until `check()` is truthy (events are applied by a background worker)."""
+    deadline = time.time() + TIMEOUT
+    while time.time() < deadline:
+        result = check()
+        if result:
+            return result
+        time.sleep(0.1)
+    raise AssertionError("condition not met in time")
+
+
+@pytest.fixture(scope="module")
+def servers(tmp_path_factory):
+    workdir = tmp_path_factory.mktemp("cadence")
+    with open(workdir / "tokens.json", "w") as f:
+        json.dump({"access_token": "test", "refresh_token": "test", "expires_at": 2 ** 31}, f)
+
+    strava_port, app_port = _free_port(), _free_port()
+    env = dict(os.environ,
+               PYTHONPATH=REPO,
+               STRAVA_API_BASE=f"http://127.0.0.1:{strava_port}/api/v3",
+               STRAVA_OAUTH_URL=f"http://127.0.0.1:{strava_port}/oauth/token",
+               OPENAI_BASE_URL="http://127.0.0.1:9/v1",  # plan regeneration may fail; not under test
+               OPENAI_API_KEY="test",
+               SECRET_KEY="test")
+    # Caches default to paths relative to the working directory, outside the repo
+    for key in ("CADENCE_DB", "CADENCE_DATA_DIR", "STRAVA_SUBSCRIPTION_ID", "STICKER_CACHE_DIR"):
+        env.pop(key, None)
+
+    log = open(workdir / "servers.log", "w")
+    procs = [
+        subprocess.Popen([sys.executable, "-m", "fakes.strava", "--port", str(strava_port)],
+                         cwd=REPO, env=env, stdout=log, stderr=subprocess.STDOUT),
+        subprocess.Popen([sys.executable, "-m", "flask", "--app", "app", "run", "--port", str(app_port)],
+                         cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT),
+    ]
+    try:
+        base_url = f"http://127.0.0.1:{app_port}"
+        fake_url = f"http://127.0.0.1:{strava_port}"
+        _wait_for(f"{fake_url}/api/v3/push_subscriptions")
+        _wait_for(f"{base_url}/metrics")
+        subprocess.run([sys.executable, "-m", "flask", "--app", "app", "subscribe-webhook",
+                        f"{base_url}/webhooks/strava"], cwd=workdir, env=env, check=True,
+                       stdout=log, stderr=subprocess.STDOUT)
+        yield {"app": base_url, "fake": fake_url, "workdir": workdir}
+    finally:
+        for proc in procs:
+            proc.terminate()
+            proc.wait(timeout=10)
+        log.close()
+
+
+def _activity(workdir, activity_id):
+    conn = sqlite3.connect(workdir / "cadence.db")
+    try:
+        return conn.execute("SELECT name, distance FROM activities WHERE id = ?", (activity_id,)).fetchone()
+    finally:
+        conn.close()
+
+
+def _split_ids(workdir):
+    path = workdir / "data" / "splits" / "activity_id.bin"
+    return set(np.fromfile(path, dtype=np.int64).tolist()) if path.exists() else set()
+
+
+def _stickers(workdir, activity_id):
+    directory = workdir / "cache" / "stickers"
+    return [p for p in directory.glob(f"{activity_id}-*.png")] if directory.exists() else []
+
+
+def test_create_update_delete(servers):
+    app, fake, workdir = servers["app"], servers["fake"], servers["workdir"]
+
+    r = requests.post(f"{fake}/_fake/activities", json={"name": "Lunch Run", "distance": 5000, "moving_time": 1500})
+    assert r.status_code == 201 and r.json()["delivered"] == 200
+    activity_id = r.json()["id"]
+    assert _eventually(lambda: _activity(workdir, activity_id)) == ("Lunch Run", 5000.0)
+    assert _eventually(lambda: activity_id in _split_ids(workdir))
+
+    assert requests.get(f"{app}/sticker/{activity_id}.png").status_code == 200
+    assert _stickers(workdir, activity_id)
+
+    r = requests.post(f"{fake}/_fake/activities", json={"id": activity_id, "name": "Long Run", "distance": 12000})
+    assert r.json()["delivered"] == 200
+    assert _eventually(lambda: _activity(workdir, activity_id) == ("Long Run", 12000.0))
+    assert _eventually(lambda: not _stickers(workdir, activity_id))  # stale sticker invalidated
+    assert activity_id in _split_ids(workdir)
+
+    r = requests.delete(f"{fake}/_fake/activities/{activity_id}")
+    assert r.json()["delivered"] == 200
+    assert _eventually(lambda: _activity(workdir, activity_id) is None)
+    assert _eventually(lambda: activity_id not in _split_ids(workdir))
+
+
+def test_rejects_events_for_other_subscriptions(servers):
+    event = {"object_type": "athlete", "object_id": 1, "aspect_type": "update", "owner_id": 1,
+             "updates": {"authorized": "false"}, "event_time": int(time.time())}
+    r = requests.post(f"{servers['app']}/webhooks/strava", json=event)
+    assert r.status_code == 403
+    r = requests.post(f"{servers['app']}/webhooks/strava", json=dict(event, subscription_id=999))
+    assert r.status_code == 403
+    assert (servers["workdir"] / "tokens.json").exists()
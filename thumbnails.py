@@ -0,0 +1,78 @@
+import os
+import threading
+
+from PIL import Image, ImageDraw
+
+import geometry
+import metrics
+from fileutil import evict_lru, remove_prefixed
+
+CACHE_DIR = os.getenv("THUMBNAIL_CACHE_DIR", os.path.join("cache", "thumbs"))
+STYLE_VERSION = 1  # bump when the look changes so clients and the cache refresh
+
+# name -> (pixel size, polyline simplification level)
+SIZES = {
+    "sm": (160, "thumb"),
+    "md": (320, "card"),
+    "lg": (1080, "detail"),
+}
+FORMATS = {"png": ("PNG", "image/png"), "webp": ("WEBP", "image/webp")}
+BACKGROUND = (34, 34, 34, 255)
+ROUTE_COLOR = (252, 76, 2, 255)
+SUPERSAMPLE = 2  # draw at 2x and downscale for smooth lines
+MAX_FILES = 5000
+MAX_BYTES = 200 * 1024 * 1024
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def etag(encoded, size, fmt):
+    """Validator for a thumbnail; changes only when the route, size, format or style change."""
+    return f"{geometry.source_hash(encoded)[:16]}-{size}-{fmt}-v{STYLE_VERSION}"
+
+
+def render(points, px, fmt, path):
+    big = px * SUPERSAMPLE
+    img = Image.new("RGBA", (big, big), BACKGROUND)
+    draw = ImageDraw.Draw(img)
+    pad = big // 10
+    projected = geometry.project_route(points, (pad, pad, big - pad, big - pad))
+    draw.line([tuple(p) for p in projected.tolist()], fill=ROUTE_COLOR,
+              width=max(2, big // 80), joint="curve")
+    img = img.resize((px, px), Image.LANCZOS).convert("RGB")
+
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    img.save(tmp_path, FORMATS[fmt][0], optimize=True)
+    os.replace(tmp_path, path)
+
+
+def _lock_for(path):
+    with _locks_guard:
+        return _locks.setdefault(path, threading.Lock())
+
+
+def get_thumbnail(activity_id, encoded, size="md", fmt="png"):
+    """Path of the cached thumbnail, rendering it on first request."""
+    px, level = SIZES[size]
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = os.path.join(CACHE_DIR, f"{activity_id}-{etag(encoded, size, fmt)}.{fmt}")
+    if os.path.exists(path):
+        os.utime(path)  # mark as recently used for eviction
+        metrics.cache_event("thumbnails", True)
+        return path
+    metrics.cache_event("thumbnails", False)
+
+    with _lock_for(path):
+        if not os.path.exists(path):
+            points = geometry.decode(geometry.route_variant(activity_id, encoded, level))
+            with metrics.span("thumbnail_render"):
+                render(points, px, fmt, path)
+            evict_lru(CACHE_DIR, MAX_FILES, MAX_BYTES, suffixes=tuple(f".{f}" for f in FORMATS))
+    with _locks_guard:
+        _locks.pop(path, None)
+    return path
+
+
+def invalidate(activity_id):
+    return remove_prefixed(CACHE_DIR, f"{activity_id}-")
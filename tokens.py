@@ -0,0 +1,83 @@
+import os
+import json
+import time
+import threading
+
+import strava_client
+from fileutil import atomic_write_json, file_lock
+
+TOKENS_FILE = "tokens.json"
+REFRESH_MARGIN = 300  # refresh this many seconds before expires_at
+
+
+class TokenManager:
+    """Keeps Strava tokens in memory and refreshes them once, for everyone.
+
+    The first caller that finds the token close to expiry takes the lock and
+    refreshes; concurrent callers block on the same lock and then reuse the
+    fresh token. A file lock extends this across worker processes, and each
+    process picks up the others' refreshes by watching the file's mtime.
+    """
+
+    def __init__(self, path=TOKENS_FILE, client_id=None, client_secret=None):
+        self.path = path
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.tokens = None
+        self.mtime = None
+        self.lock = threading.Lock()
+
+    def _reload_if_changed(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            self.tokens, self.mtime = None, None
+            return
+        if mtime != self.mtime:
+            with open(self.path, "r") as f:
+                self.tokens = json.load(f)
+            self.mtime = mtime
+
+    def _fresh(self):
+        return self.tokens and self.tokens.get("expires_at", 0) - REFRESH_MARGIN > time.time()
+
+    def save(self, tokens):
+        """Persist a new token set (e.g. from the OAuth callback)."""
+        with self.lock:
+            atomic_write_json(self.path, tokens)
+            self.tokens = tokens
+            self.mtime = os.stat(self.path).st_mtime_ns
+
+    def access_token(self):
+        """Return a valid access token, refreshing it if needed (None if not connected)."""
+        self._reload_if_changed()
+        if self._fresh():
+            return self.tokens["access_token"]
+        if not self.tokens:
+            return None
+
+        with self.lock, file_lock(self.path):
+            # Another thread or worker may have refreshed while we waited
+            self._reload_if_changed()
+            if self._fresh():
+                return self.tokens["access_token"]
+
+            try:
+                refreshed = strava_client.post_oauth({
+                    "client_id": self.client_id,
+                    "client_secret": self.client_secret,
+                    "grant_type": "refresh_token",
+                    "refresh_token": self.tokens.get("refresh_token"),
+                })
+            except strava_client.StravaError:
+                # Keep serving the old token while it is still technically valid
+                if self.tokens.get("expires_at", 0) > time.time():
+                    return self.tokens.get("access_token")
+                raise
+
+            tokens = {**self.tokens, **refreshed}
+            atomic_write_json(self.path, tokens)
+            self.tokens = tokens
+            self.mtime = os.stat(self.path).st_mtime_ns
+
+        return self.tokens.get("access_token")
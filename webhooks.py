@@ -0,0 +1,220 @@
+import os
+import json
+import time
+import threading
+from datetime import date, timedelta
+
+import analytics
+import plan_store
+import stickers
+import store
+import strava_client
+import streams
+import sync
+import tenancy
+import thumbnails
+
+VERIFY_TOKEN = os.getenv("STRAVA_VERIFY_TOKEN", "cadence")
+# Id of our push subscription; set it here or let `flask subscribe-webhook` record it
+SUBSCRIPTION_ID = os.getenv("STRAVA_SUBSCRIPTION_ID")
+MAX_ATTEMPTS = 5
+RETRY_BASE = 5  # seconds; doubled on every failed attempt
+RETRY_MAX = 600
+STALE_CLAIM = 300  # a "processing" event older than this belongs to a dead worker
+POLL_INTERVAL = 30  # fallback wake-up when no enqueue signal arrives (other processes)
+KEEP_DONE = 7 * 86400
+# Store columns that feed training load; edits to anything else don't warrant a new plan
+LOAD_FIELDS = ("sport", "start_ts", "distance", "moving_time", "avg_hr", "avg_power")
+
+_wakeup = threading.Event()
+_worker = None
+_get_token = None
+
+
+def verify(mode, token):
+    return mode == "subscribe" and token == VERIFY_TOKEN
+
+
+def subscription_id():
+    if SUBSCRIPTION_ID:
+        return int(SUBSCRIPTION_ID)
+    with tenancy.use(None):
+        return store.get_state("webhook_subscription_id")
+
+
+def subscribe(callback_url, client_id, client_secret):
+    """Create the push subscription (Strava calls back for the handshake) and record its id."""
+    r = strava_client.session.post(f"{strava_client.API_BASE}/push_subscriptions", data={
+        "client_id": client_id, "client_secret": client_secret,
+        "callback_url": callback_url, "verify_token": VERIFY_TOKEN,
+    }, timeout=strava_client.TIMEOUT)
+    if not r.ok:
+        raise strava_client.StravaError(f"Strava push_subscriptions {r.status_code}: {r.text}", status=r.status_code)
+    subscription = r.json()["id"]
+    with tenancy.use(None):
+        store.set_state("webhook_subscription_id", subscription)
+    return subscription
+
+
+def authentic(event):
+    """Only events for our own subscription are accepted; the callback URL itself is public."""
+    expected = subscription_id()
+    return expected is not None and str(event.get("subscription_id")) == str(expected)
+
+
+def enqueue(event):
+    """Persist an event for the worker; returns as soon as it is committed."""
+    # One queue per node (Strava sends every athlete's events to the same callback)
+    conn = store.get_shared_db()
+    with conn:
+        conn.execute(
+            "INSERT INTO webhook_events (payload, received_at) VALUES (?, ?)",
+            (json.dumps(event), int(time.time())))
+    _wakeup.set()
+
+
+def _claim():
+    """Atomically take the oldest due event (safe across worker processes)."""
+    now = int(time.time())
+    conn = store.get_shared_db()
+    with conn:
+        conn.execute(
+            "UPDATE webhook_events SET status = 'pending' "
+            "WHERE status = 'processing' AND claimed_at < ?", (now - STALE_CLAIM,))
+        row = conn.execute("""
+            UPDATE webhook_events SET status = 'processing', attempts = attempts + 1, claimed_at = ?
+            WHERE id = (SELECT id FROM webhook_events WHERE status = 'pending' AND next_attempt <= ?
+                        ORDER BY id LIMIT 1)
+            RETURNING id, payload, attempts
+        """, (now, now)).fetchone()
+    return (row["id"], json.loads(row["payload"]), row["attempts"]) if row else None
+
+
+def _finish(event_id, error=None, attempts=0):
+    conn = store.get_shared_db()
+    with conn:
+        if error is None:
+            conn.execute("UPDATE webhook_events SET status = 'done', error = NULL WHERE id = ?", (event_id,))
+        elif attempts >= MAX_ATTEMPTS:
+            conn.execute("UPDATE webhook_events SET status = 'failed', error = ? WHERE id = ?",
+                         (error, event_id))
+        else:
+            delay = min(RETRY_BASE * 2 ** (attempts - 1), RETRY_MAX)
+            conn.execute(
+                "UPDATE webhook_events SET status = 'pending', error = ?, next_attempt = ? WHERE id = ?",
+                (error, int(time.time()) + delay, event_id))
+        conn.execute("DELETE FROM webhook_events WHERE status = 'done' AND received_at < ?",
+                     (int(time.time()) - KEEP_DONE,))
+
+
+def invalidate(activity_id):
+    """Drop everything derived from one activity."""
+    strava_client.cache.invalidate(f"/activities/{activity_id}")
+    stickers.invalidate(activity_id)
+    streams.invalidate(activity_id)
+    thumbnails.invalidate(activity_id)
+
+
+def _revoke():
+    """The athlete deauthorized the app: forget their tokens."""
+    try:
+        os.unlink(tenancy.path("tokens.json"))
+    except FileNotFoundError:
+        pass
+
+
+def _refresh_plans():
+    # Tomorrow's plan was written without this activity; regenerate it
+    plan_store.delete_plan(date.today() + timedelta(days=1))
+    for callback in sync.on_new_activities:
+        callback()
+
+
+def _delete(activity_id):
+    store.delete_activity(activity_id)
+    analytics.remove_activity(activity_id)
+    invalidate(activity_id)
+    _refresh_plans()
+
+
+def _upsert(activity_id, created=False):
+    try:
+        detail = strava_client.get(
+            f"/activities/{activity_id}", _get_token(),
+            params={"include_all_efforts": "false"}, use_cache=False,
+        )
+    except strava_client.StravaError as e:
+        if e.status == 404:  # deleted or made private since the event was sent
+            return _delete(activity_id)
+        raise
+    before = store.get_activity(activity_id)
+    store.save_detail(detail)
+    after = store.get_activity(activity_id)
+    splits_changed = analytics.replace_detail(detail)
+    invalidate(activity_id)
+    if created or before is None or splits_changed or any(before[f] != after[f] for f in LOAD_FIELDS):
+        _refresh_plans()
+
+
+def _owner(event):
+    """Athlete partition an event belongs to (None in legacy mode); False if unknown here."""
+    owner = event.get("owner_id")
+    if owner is not None and tenancy.exists(owner):
+        return int(owner)
+    return None if tenancy.legacy_mode() else False
+
+
+def process(event):
+    """Apply one Strava push event to the owner's local data."""
+    owner = _owner(event)
+    if owner is False:
+        return  # athlete not hosted on this node
+    with tenancy.use(owner):
+        if event.get("object_type") == "athlete":
+            if (event.get("updates") or {}).get("authorized") == "false":
+                _revoke()
+            return
+        # Events arriving means the subscription works: page views can stop polling
+        store.set_state("webhook_active", True)
+        activity_id = int(event["object_id"])
+        if event.get("aspect_type") == "delete":
+            _delete(activity_id)
+        else:
+            _upsert(activity_id, created=event.get("aspect_type") == "create")
+
+
+def run_pending():
+    """Process due events until the queue is empty; returns how many were handled."""
+    handled = 0
+    while True:
+        claimed = _claim()
+        if claimed is None:
+            return handled
+        event_id, event, attempts = claimed
+        try:
+            process(event)
+        except Exception as e:
+            _finish(event_id, f"{type(e).__name__}: {e}", attempts)
+        else:
+            _finish(event_id)
+        handled += 1
+
+
+def _loop():
+    while True:
+        _wakeup.wait(POLL_INTERVAL)
+        _wakeup.clear()
+        try:
+            run_pending()
+        except Exception:
+            pass
+
+
+def start(get_token):
+    """Register the access-token getter and start the background worker."""
+    global _get_token, _worker
+    _get_token = get_token
+    if _worker is None:
+        _worker = threading.Thread(target=_loop, name="strava-webhooks", daemon=True)
+        _worker.start()
+        _wakeup.set()  # pick up anything left from a previous run